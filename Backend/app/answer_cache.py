@@ -0,0 +1,94 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from .config import ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY
+from .chat_engine import normalize_question
+
+
+class AnswerCache:
+    """
+    LRU of finished chat answers keyed by (corpus fingerprint, normalized question, retrieval scope).
+
+    If a question embedding is passed, a miss on the exact key falls back to the most similar
+    cached question for the same corpus and scope, provided it clears the similarity threshold.
+    """
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._embeddings: Dict[Tuple[str, str, str], np.ndarray] = {}
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(fingerprint: str, question: str, where: Optional[Dict[str, Any]] = None) -> Tuple[str, str, str]:
+        scope = json.dumps(where, sort_keys=True) if where else ""
+        return (fingerprint, normalize_question(question), scope)
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+    def get(self, fingerprint: str, question: str, where: Optional[Dict[str, Any]] = None, embedding=None) -> Optional[Tuple[Dict[str, Any], str]]:
+        """Returns (cached result, "exact" | "semantic") or None."""
+        key = self.make_key(fingerprint, question, where)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return self._entries[key], "exact"
+
+            if embedding is not None:
+                query = self._unit(embedding)
+                best_key, best_sim = None, self.similarity
+                for other, vec in self._embeddings.items():
+                    if other[0] != key[0] or other[2] != key[2]:
+                        continue
+                    sim = float(vec @ query)
+                    if sim >= best_sim:
+                        best_key, best_sim = other, sim
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key], "semantic"
+
+            self.misses += 1
+            return None
+
+    def put(self, fingerprint: str, question: str, where: Optional[Dict[str, Any]], result: Dict[str, Any], embedding=None):
+        if not fingerprint:
+            return
+        key = self.make_key(fingerprint, question, where)
+        # The packed prompt (up to CHAT_CONTEXT_TOKENS of context) is not needed to serve a hit
+        result = {k: v for k, v in result.items() if k != "prompt"}
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            if embedding is not None:
+                self._embeddings[key] = self._unit(embedding)
+            while len(self._entries) > self.max_entries:
+                old, _ = self._entries.popitem(last=False)
+                self._embeddings.pop(old, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.exact_hits + self.semantic_hits) / lookups) if lookups else 0.0,
+            }
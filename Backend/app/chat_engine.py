@@ -1,105 +1,344 @@
-from typing import List, Dict, Any
-from .core_utils import get_all_chunks_from_collection, call_llm_answer, call_llm_text_only,generate_multi_queries,get_wikipedia_summary
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Dict, Any, Optional
+from .core_utils import call_llm_answer,generate_multi_queries,agenerate_multi_queries,get_wikipedia_summary,stream_llm_text
+from .config import RETRIEVAL_MODE, RETRIEVAL_WEAK_DISTANCE, QUERY_VARIANT_CACHE_SIZE, RETRIEVAL_HYBRID, LEXICAL_STRONG_COVERAGE, VECTOR_BACKEND, CHAT_CONTEXT_TOKENS
+from .vector_index import MatrixIndex
+from .token_budget import pack_context
+from .llm_async import acall_llm_text_only
 
-def retrieve_top_k(collection, query: str, embed_model, k: int = 4):
-    import numpy as np
-    q_emb = embed_model.encode([query], convert_to_numpy=True)[0].tolist()
+def build_where_filter(source_files: Optional[List[str]] = None, page_from: Optional[int] = None, page_to: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Chroma `where` filter from request scoping (e.g. only lecture3.pdf, pages 10-20)."""
+    clauses: List[Dict[str, Any]] = []
+    if source_files:
+        clauses.append({"source_file": {"$in": list(source_files)}})
+    # A chunk overlaps [page_from, page_to] if it ends at/after page_from and starts at/before page_to
+    if page_from is not None:
+        clauses.append({"page_end": {"$gte": int(page_from)}})
+    if page_to is not None:
+        clauses.append({"page_start": {"$lte": int(page_to)}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def _ids_matching(collection, where: Optional[Dict[str, Any]]) -> Optional[set]:
+    """Chunk ids passing a where filter (None = no filter)."""
+    if not where:
+        return None
+    return set(collection.get(where=where, include=[])["ids"])
+
+def _local_top_k(collection, q_embs, k: int, where: Optional[Dict[str, Any]] = None, local_index_fn: Optional[Callable] = None) -> List[List[Dict[str, Any]]]:
+    # Stored embeddings only: the corpus is never re-encoded at query time
+    index = local_index_fn() if local_index_fn else MatrixIndex.from_collection(collection)
+    return index.search(q_embs, k=k, allowed_ids=_ids_matching(collection, where))
+
+def retrieve_top_k_multi(collection, queries: List[str], embed_model, k: int = 4, where: Optional[Dict[str, Any]] = None, local_index_fn: Optional[Callable] = None, backend: str = VECTOR_BACKEND) -> List[List[Dict[str, Any]]]:
+    """
+    Encodes all queries in one batch and runs a single multi-embedding search (optionally metadata-filtered).
+    backend="chroma" uses collection.query; backend="local" (and the fallback when Chroma fails)
+    uses the in-memory matrix index returned by local_index_fn.
+    """
+    if not queries:
+        return []
+    q_embs = embed_model.encode(list(queries), convert_to_numpy=True)
+    if backend == "local":
+        return _local_top_k(collection, q_embs, k, where, local_index_fn)
     try:
         res = collection.query(
-            query_embeddings=[q_emb],
+            query_embeddings=[e.tolist() for e in q_embs],
             n_results=k,
+            where=where,
             include=["documents", "metadatas", "distances"]
         )
     except Exception as e:
         print("Collection.query failed:", e)
-        all_chunks = get_all_chunks_from_collection(collection)
-        docs = [c["text"] for c in all_chunks]
-        emb_all = embed_model.encode(docs, convert_to_numpy=True)
-        q_np = np.array(q_emb)
-        dists = np.linalg.norm(emb_all - q_np, axis=1)
-        idxs = np.argsort(dists)[:k]
-        return [
-            {
-                "id": all_chunks[i].get("metadata", {}).get("id", f"chunk_{i}"),
-                "text": all_chunks[i]["text"],
-                "metadata": all_chunks[i].get("metadata", {}),
-                "distance": float(dists[i])
-            }
-            for i in idxs
-        ]
-
-    docs = res["documents"][0]
-    metas = res["metadatas"][0]
-    dists = res["distances"][0]
+        return _local_top_k(collection, q_embs, k, where, local_index_fn)
+
+    results = []
+    for qi in range(len(queries)):
+        docs = res["documents"][qi]
+        metas = res["metadatas"][qi] if res.get("metadatas") else []
+        dists = res["distances"][qi]
+        ids = res["ids"][qi] if res.get("ids") else []
+        out = []
+        for i in range(len(docs)):
+            meta = metas[i] if metas and i < len(metas) else {}
+            cid = ids[i] if i < len(ids) else meta.get("id", f"chunk_{i}")
+            out.append({
+                "id": cid,
+                "text": docs[i],
+                "metadata": meta,
+                "distance": dists[i]
+            })
+        results.append(out)
+    return results
+
+def retrieve_top_k(collection, query: str, embed_model, k: int = 4, where: Optional[Dict[str, Any]] = None, local_index_fn: Optional[Callable] = None):
+    return retrieve_top_k_multi(collection, [query], embed_model, k=k, where=where, local_index_fn=local_index_fn)[0]
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], rrf_k: int = 60) -> List[Dict[str, Any]]:
+    """Merges ranked lists with RRF: score(d) = sum(1 / (rrf_k + rank)). Best first."""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            scores[doc["id"]] = scores.get(doc["id"], 0.0) + 1.0 / (rrf_k + rank)
+            # Keep the closest hit for each id
+            if doc["id"] not in docs or doc["distance"] < docs[doc["id"]]["distance"]:
+                docs[doc["id"]] = doc
+    fused = sorted(scores, key=lambda cid: (-scores[cid], docs[cid]["distance"]))
+    return [dict(docs[cid], rrf_score=scores[cid]) for cid in fused]
+
+# --- QUERY VARIANT CACHE ---
+_variant_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+_variant_cache_lock = threading.Lock()
+
+def normalize_question(question: str) -> str:
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip(" ?!.")
+
+def _cached_variants(question: str) -> Optional[Dict[str, Any]]:
+    key = normalize_question(question)
+    with _variant_cache_lock:
+        if key in _variant_cache:
+            _variant_cache.move_to_end(key)
+            return {"queries": [question] + _variant_cache[key], "cache_hit": True}
+    return None
+
+def _store_variants(question: str, queries: List[str]) -> Dict[str, Any]:
+    if len(queries) < 2:
+        # Failed or empty LLM reply: do not pin "no variants" for this question
+        return {"queries": queries, "cache_hit": False}
+    with _variant_cache_lock:
+        _variant_cache[normalize_question(question)] = queries[1:]
+        while len(_variant_cache) > QUERY_VARIANT_CACHE_SIZE:
+            _variant_cache.popitem(last=False)
+    return {"queries": queries, "cache_hit": False}
+
+def get_query_variants(question: str, call_llm_fn) -> Dict[str, Any]:
+    """Returns the LLM query variants for a question, cached by normalized question."""
+    return _cached_variants(question) or _store_variants(question, generate_multi_queries(question, call_llm_fn))
+
+async def aget_query_variants(question: str, acall_llm_fn) -> Dict[str, Any]:
+    """get_query_variants with the LLM call awaited on the event loop."""
+    return _cached_variants(question) or _store_variants(question, await agenerate_multi_queries(question, acall_llm_fn))
+
+def lexical_search(collection, lexical_index, query: str, k: int = 4, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """BM25 hits for the query, resolved to chunk text/metadata from the collection."""
+    try:
+        allowed_ids = _ids_matching(collection, where)
+    except Exception as e:
+        print("Lexical filter lookup failed:", e)
+        return []
+    hits = lexical_index.search(query, k=k, allowed_ids=allowed_ids)
+    if not hits:
+        return []
+    res = collection.get(ids=[h["id"] for h in hits], include=["documents", "metadatas"])
+    found = {cid: (doc, meta) for cid, doc, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or [])}
     out = []
-    for i in range(len(docs)):
-        meta = metas[i] if metas and i < len(metas) else {}
-        cid = meta.get("id", f"chunk_{i}")
-        out.append({
-            "id": cid,
-            "text": docs[i],
-            "metadata": meta,
-            "distance": dists[i]
-        })
+    for h in hits:
+        if h["id"] in found:
+            doc, meta = found[h["id"]]
+            # No vector distance for lexical-only hits; RRF ranks them by position instead
+            out.append({"id": h["id"], "text": doc, "metadata": meta or {}, "distance": float("inf"),
+                        "bm25_score": h["bm25_score"], "coverage": h["coverage"]})
     return out
 
-def build_context_from_retrieval(retrieved: List[Dict[str, Any]], max_chars_per_chunk: int = 1500):
-    parts = []
-    for r in retrieved:
-        snippet = r["text"] if len(r["text"]) <= max_chars_per_chunk else r["text"][:max_chars_per_chunk] + "..."
-        parts.append(f"SOURCE_ID: {r['id']}\n{snippet}")
-    return "\n\n---\n\n".join(parts)
+def _first_pass(question: str, collection, embed_model, k: int, mode: str, weak_distance: float, where, lexical_index, hybrid: bool, local_index_fn):
+    """Single-query (+ BM25) retrieval. Returns (per_query, telemetry, whether query variants are needed)."""
+    telemetry: Dict[str, Any] = {"mode": mode}
+    per_query: List[List[Dict[str, Any]]] = []
+    best: Optional[float] = None
+    lexical_strong = False
+
+    if mode != "multi_query":
+        per_query = retrieve_top_k_multi(collection, [question], embed_model, k=k, where=where, local_index_fn=local_index_fn)
+        best = min((d["distance"] for d in per_query[0]), default=None)
+        telemetry["best_distance"] = best
+
+    if hybrid and lexical_index is not None:
+        lexical = lexical_search(collection, lexical_index, question, k=k, where=where)
+        if lexical:
+            per_query.append(lexical)
+            telemetry["bm25_coverage"] = round(lexical[0]["coverage"], 3)
+            lexical_strong = lexical[0]["coverage"] >= LEXICAL_STRONG_COVERAGE
+
+    weak = (best is None or best > weak_distance) and not lexical_strong
+    want_variants = mode == "multi_query" or (mode == "adaptive" and weak)
+    if not want_variants:
+        telemetry["path"] = "single"
+    return per_query, telemetry, want_variants
+
+def _variant_queries(question: str, variants: Dict[str, Any], mode: str, telemetry: Dict[str, Any]) -> List[str]:
+    telemetry["variant_cache_hit"] = variants["cache_hit"]
+    telemetry["path"] = "multi_query"
+    # The original question was already retrieved in the first pass in adaptive mode
+    return [q for q in variants["queries"] if q != question] if mode != "multi_query" else variants["queries"]
+
+def _variants_failed(e: Exception, question: str, mode: str, telemetry: Dict[str, Any]) -> List[str]:
+    """Variants only add recall: answer from the hits we already have (multi_query mode still needs the question)."""
+    print(f"[Retrieval] Query variants failed, using single-query hits: {e}")
+    telemetry["variants_error"] = str(e)
+    telemetry["path"] = "single"
+    return [question] if mode == "multi_query" else []
+
+def _finish_retrieval(per_query, telemetry: Dict[str, Any], started: float, max_results: int):
+    telemetry["queries"] = len(per_query)
+    telemetry["retrieval_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[Retrieval] {telemetry}")
+    return reciprocal_rank_fusion(per_query)[:max_results], telemetry
 
-def answer_question_rag(question: str, collection, embed_model, call_llm_fn=call_llm_answer, k: int = 4, temperature: float = 0.0, max_tokens: int = 512):
+def retrieve_for_question(question: str, collection, embed_model, call_llm_fn, k: int = 4, mode: str = RETRIEVAL_MODE, weak_distance: float = RETRIEVAL_WEAK_DISTANCE, max_results: int = 8, where: Optional[Dict[str, Any]] = None, lexical_index=None, hybrid: bool = RETRIEVAL_HYBRID, local_index_fn: Optional[Callable] = None):
     """
-    Hybrid RAG:
-    1. Try Multi-Query RAG on local documents.
-    2. If the answer is "I don't know", fallback to Wikipedia.
+    mode="single":      one embedding query, no LLM call.
+    mode="multi_query": always ask the LLM for variants and fuse the results.
+    mode="adaptive":    single query first; variants only when recall looks weak.
+    With hybrid and a lexical_index, BM25 hits for the question are fused in as well, and a strong
+    lexical match (exact course codes, acronyms, ...) counts as good recall in adaptive mode.
+    Returns (retrieved, telemetry).
     """
-    
-    # --- PHASE 1: LOCAL RAG (Multi-Query) ---
-    print(f"Generating variations for: '{question}'...")
-    queries = generate_multi_queries(question, call_llm_fn)
-    
-    all_retrieved = []
-    seen_ids = set()
-    
-    for q in queries:
-        docs = retrieve_top_k(collection, q, embed_model, k=k)
-        for doc in docs:
-            if doc['id'] not in seen_ids:
-                seen_ids.add(doc['id'])
-                all_retrieved.append(doc)
-    
-    final_retrieved = all_retrieved[:8] 
-    context = build_context_from_retrieval(final_retrieved)
+    started = time.perf_counter()
+    per_query, telemetry, want_variants = _first_pass(question, collection, embed_model, k, mode, weak_distance, where, lexical_index, hybrid, local_index_fn)
+    if want_variants:
+        try:
+            extra = _variant_queries(question, get_query_variants(question, call_llm_fn), mode, telemetry)
+            per_query += retrieve_top_k_multi(collection, extra, embed_model, k=k, where=where, local_index_fn=local_index_fn)
+        except Exception as e:
+            per_query += retrieve_top_k_multi(collection, _variants_failed(e, question, mode, telemetry), embed_model, k=k, where=where, local_index_fn=local_index_fn)
+    return _finish_retrieval(per_query, telemetry, started, max_results)
+
+async def aretrieve_for_question(question: str, collection, embed_model, acall_llm_fn, k: int = 4, mode: str = RETRIEVAL_MODE, weak_distance: float = RETRIEVAL_WEAK_DISTANCE, max_results: int = 8, where: Optional[Dict[str, Any]] = None, lexical_index=None, hybrid: bool = RETRIEVAL_HYBRID, local_index_fn: Optional[Callable] = None):
+    """
+    retrieve_for_question for the event loop: Chroma queries and encoding run in worker threads,
+    the query-variant LLM call (and its retry waits) is awaited.
+    """
+    started = time.perf_counter()
+    per_query, telemetry, want_variants = await asyncio.to_thread(
+        _first_pass, question, collection, embed_model, k, mode, weak_distance, where, lexical_index, hybrid, local_index_fn
+    )
+    if want_variants:
+        try:
+            extra = _variant_queries(question, await aget_query_variants(question, acall_llm_fn), mode, telemetry)
+            per_query += await asyncio.to_thread(retrieve_top_k_multi, collection, extra, embed_model, k=k, where=where, local_index_fn=local_index_fn)
+        except Exception as e:
+            per_query += await asyncio.to_thread(retrieve_top_k_multi, collection, _variants_failed(e, question, mode, telemetry), embed_model, k=k, where=where, local_index_fn=local_index_fn)
+    return _finish_retrieval(per_query, telemetry, started, max_results)
+
+def build_context_from_retrieval(retrieved: List[Dict[str, Any]], budget_tokens: int = CHAT_CONTEXT_TOKENS, telemetry: Optional[Dict[str, Any]] = None):
+    """Packs the retrieved chunks (relevance order, overlap removed) into the context token budget."""
+    blocks, stats = pack_context(retrieved, budget_tokens, lambda r, text: f"SOURCE_ID: {r['id']}\n{text}")
+    if telemetry is not None:
+        telemetry["context"] = stats
+    return "\n\n---\n\n".join(blocks)
+
+IDK_PHRASE = "I don't know based on the provided document"
+WIKI_PREFIX = "I couldn't find that in your uploaded documents, but here is what I found on Wikipedia:\n\n"
+NOTHING_FOUND = "I couldn't find that information in your documents or on Wikipedia."
+
+def build_answer_prompt(question: str, retrieved: List[Dict[str, Any]], telemetry: Optional[Dict[str, Any]] = None) -> str:
+    context = build_context_from_retrieval(retrieved, telemetry=telemetry)
     
     instruction = (
         "Using ONLY the provided context below, answer the user question precisely and concisely. "
         "If the answer is strictly NOT present in the context, output EXACTLY this phrase: 'I don't know based on the provided document.'"
     )
 
-    prompt = f"{instruction}\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:"
-    
-    try:
-        llm_resp = call_llm_text_only(prompt, max_tokens=max_tokens, temperature=temperature)
-    except NameError:
-        llm_resp = call_llm_fn(prompt, max_tokens=max_tokens, temperature=temperature)
-    
-    final_answer = llm_resp.strip()
+    return f"{instruction}\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:"
 
-    # --- PHASE 2: WIKIPEDIA FALLBACK ---
-    
-    # Check if the AI gave up
-    if "I don't know based on the provided document" in final_answer or len(final_answer) < 5:
+def _is_idk(answer: str) -> bool:
+    """The model gave up (the phrase anywhere in the answer, or next to no text). Shared by /chat and /chat/stream."""
+    return IDK_PHRASE in answer or len(answer) < 5
+
+def _idk_partial_suffix(text: str) -> int:
+    """Length of the longest tail of `text` that could still grow into the give-up phrase."""
+    for n in range(min(len(text), len(IDK_PHRASE) - 1), 0, -1):
+        if IDK_PHRASE.startswith(text[-n:]):
+            return n
+    return 0
+
+async def aanswer_question_rag(question: str, collection, embed_model, k: int = 4, temperature: float = 0.0, max_tokens: int = 512, retrieval_mode: str = RETRIEVAL_MODE, where: Optional[Dict[str, Any]] = None, lexical_index=None, local_index_fn: Optional[Callable] = None, acall_llm_fn=acall_llm_text_only):
+    """
+    Hybrid RAG:
+    1. Retrieve from local documents (multi-query only when single-query recall is weak).
+    2. If the answer is "I don't know", fallback to Wikipedia.
+    Chroma, the encoder and the Wikipedia fallback run in worker threads; the query-variant and
+    answer LLM calls (acall_llm_fn) are awaited on the pooled async client.
+    """
+    final_retrieved, telemetry = await aretrieve_for_question(
+        question, collection, embed_model, acall_llm_fn,
+        k=k, mode=retrieval_mode, where=where, lexical_index=lexical_index, local_index_fn=local_index_fn
+    )
+    prompt = build_answer_prompt(question, final_retrieved, telemetry)
+    final_answer = (await acall_llm_fn(prompt, max_tokens=max_tokens, temperature=temperature) or "").strip()
+
+    if _is_idk(final_answer):
+        print("I don't know based on the provided document Local RAG failed. Searching Wikipedia...")
+        telemetry["wikipedia_fallback"] = True
+        wiki_result = await asyncio.to_thread(get_wikipedia_summary, question)
+        final_answer = f"{WIKI_PREFIX}{wiki_result}" if wiki_result else NOTHING_FOUND
+
+    sources = [r["id"] for r in final_retrieved]
+    return {"question": question, "answer": final_answer, "sources": sources, "prompt": prompt, "telemetry": telemetry}
+
+def stream_answer_question_rag(question: str, collection, embed_model, call_llm_fn=call_llm_answer, k: int = 4, temperature: float = 0.0, max_tokens: int = 512, retrieval_mode: str = RETRIEVAL_MODE, where: Optional[Dict[str, Any]] = None, lexical_index=None, local_index_fn: Optional[Callable] = None):
+    """
+    Streaming variant of aanswer_question_rag. Yields events:
+      {"event": "sources", "data": [...ids]}   once retrieval is done
+      {"event": "token",   "data": "..."}      answer text as it arrives
+      {"event": "reset",   "data": null}       discard the tokens so far (see below)
+      {"event": "done",    "data": telemetry}
+    Text is held back only while it could still turn into the "I don't know" phrase, and the
+    give-up check is the same _is_idk as aanswer_question_rag: when the phrase shows up after part
+    of the answer was already sent, a reset is emitted before the (also streamed) Wikipedia fallback.
+    """
+    started = time.perf_counter()
+    final_retrieved, telemetry = retrieve_for_question(question, collection, embed_model, call_llm_fn, k=k, mode=retrieval_mode, where=where, lexical_index=lexical_index, local_index_fn=local_index_fn)
+    yield {"event": "sources", "data": [r["id"] for r in final_retrieved]}
+
+    first_token_at: Optional[float] = None
+    def _token(text: str):
+        nonlocal first_token_at
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+            telemetry["ttft_ms"] = round((first_token_at - started) * 1000, 1)
+            print(f"[Chat] Time to first token: {telemetry['ttft_ms']} ms")
+        return {"event": "token", "data": text}
+
+    prompt = build_answer_prompt(question, final_retrieved, telemetry)
+    answer = ""
+    sent = 0
+    for delta in stream_llm_text(prompt, max_tokens=max_tokens, temperature=temperature):
+        answer += delta
+        text = answer.lstrip()
+        if IDK_PHRASE in text:
+            break
+        # Too short to judge yet, or the tail may be the start of the give-up phrase -> hold it
+        safe_end = len(text) - _idk_partial_suffix(text) if len(text.strip()) >= 5 else 0
+        if safe_end > sent:
+            yield _token(text[sent:safe_end])
+            sent = safe_end
+
+    text = answer.strip()
+    if not _is_idk(text):
+        if len(text) > sent:
+            yield _token(text[sent:])
+    else:
+        if sent:
+            telemetry["stream_reset"] = True
+            yield {"event": "reset", "data": None}
         print("I don't know based on the provided document Local RAG failed. Searching Wikipedia...")
+        telemetry["wikipedia_fallback"] = True
         wiki_result = get_wikipedia_summary(question)
-        
         if wiki_result:
-            final_answer = f"I couldn't find that in your uploaded documents, but here is what I found on Wikipedia:\n\n{wiki_result}"
+            yield _token(WIKI_PREFIX)
+            # Split after sentence ends but keep the whitespace, so "\n\n(Source: ...)" arrives intact
+            for piece in re.split(r"(?<=[.!?])(?=\s)", wiki_result):
+                yield _token(piece)
         else:
-            final_answer = "I couldn't find that information in your documents or on Wikipedia."
+            yield _token(NOTHING_FOUND)
 
-    sources = [r["id"] for r in final_retrieved]
-    
-    return {"question": question, "answer": final_answer, "sources": sources, "prompt": prompt}
\ No newline at end of file
+    telemetry["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    yield {"event": "done", "data": telemetry}
@@ -1,13 +1,142 @@
 import os
+import threading
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Load variables from .env file immediately
 load_dotenv()
 
 API_KEY = os.environ.get("GROQ_API_KEY")
-if not API_KEY:
-    raise RuntimeError("GROQ_API_KEY must be set in the environment before calling call_llm_summarize()")
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://api.groq.com/openai/v1")
 
-# Initialize the client
-llm_client = OpenAI(api_key=API_KEY, base_url="https://api.groq.com/openai/v1")
\ No newline at end of file
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+def require_api_key() -> str:
+    if not API_KEY:
+        raise RuntimeError("GROQ_API_KEY must be set in the environment before calling call_llm_summarize()")
+    return API_KEY
+
+def get_llm_client():
+    """The shared (sync) OpenAI client, created on first use so importing the app stays cheap."""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                from openai import OpenAI
+                _llm_client = OpenAI(api_key=require_api_key(), base_url=LLM_BASE_URL)
+    return _llm_client
+
+def llm_client_loaded() -> bool:
+    return _llm_client is not None
+
+# How long (seconds) the provider's model catalog is trusted before models.list() is called again
+MODEL_CACHE_TTL = float(os.environ.get("MODEL_CACHE_TTL", "600"))
+
+# Provider budgets used to pace concurrent LLM calls (Groq free tier defaults)
+LLM_REQUESTS_PER_MIN = int(os.environ.get("LLM_REQUESTS_PER_MIN", "30"))
+LLM_TOKENS_PER_MIN = int(os.environ.get("LLM_TOKENS_PER_MIN", "6000"))
+
+# Max number of map / compress batches summarized at the same time
+SUMMARY_MAP_CONCURRENCY = int(os.environ.get("SUMMARY_MAP_CONCURRENCY", "4"))
+
+# On-disk embedding cache (memory-mapped float32 vectors + hash index) and its in-memory LRU layer
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "./embedding_cache")
+EMBEDDING_CACHE_LRU_SIZE = int(os.environ.get("EMBEDDING_CACHE_LRU_SIZE", "4096"))
+
+# Chat retrieval: "adaptive" only asks the LLM for query variants when single-query recall looks weak
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "adaptive")
+# Best-hit distance above which recall counts as weak (Chroma L2 on normalized MiniLM vectors: 0..4)
+RETRIEVAL_WEAK_DISTANCE = float(os.environ.get("RETRIEVAL_WEAK_DISTANCE", "1.0"))
+QUERY_VARIANT_CACHE_SIZE = int(os.environ.get("QUERY_VARIANT_CACHE_SIZE", "1024"))
+
+# Text extraction: process pool size and page-range size used to split large PDFs across workers
+EXTRACT_MAX_WORKERS = int(os.environ.get("EXTRACT_MAX_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "50"))
+# Pages where PyMuPDF finds fewer characters than this are re-read with pdfplumber
+PDF_MIN_PAGE_CHARS = int(os.environ.get("PDF_MIN_PAGE_CHARS", "20"))
+
+# Ingestion streams chunks through the encoder/vector store in batches of this size
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
+
+# Per-session corpora: max namespaces kept open in memory, idle time before a handle is closed,
+# and idle time before a namespace's collection is deleted from disk (the default one never is)
+NAMESPACE_MAX_OPEN = int(os.environ.get("NAMESPACE_MAX_OPEN", "32"))
+NAMESPACE_IDLE_TTL = float(os.environ.get("NAMESPACE_IDLE_TTL", "1800"))
+NAMESPACE_DISK_TTL = float(os.environ.get("NAMESPACE_DISK_TTL", str(7 * 24 * 3600)))
+# Background ingestion workers (jobs for the same namespace are still serialized)
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+
+# Lexical (BM25) index persisted per collection, fused with vector results when hybrid retrieval is on
+LEXICAL_INDEX_DIR = os.environ.get("LEXICAL_INDEX_DIR", "./lexical_index")
+RETRIEVAL_HYBRID = os.environ.get("RETRIEVAL_HYBRID", "1") == "1"
+# A BM25 hit containing this idf-weighted share of the query terms counts as strong recall
+LEXICAL_STRONG_COVERAGE = float(os.environ.get("LEXICAL_STRONG_COVERAGE", "0.6"))
+
+# Vector search backend for chat retrieval: "chroma" (collection.query) or "local" (NumPy matrix index).
+# The local index is always used as the fallback when collection.query fails.
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "./vector_index")
+# Persist the local index and memory-map it instead of holding the matrix in RAM
+VECTOR_INDEX_MMAP = os.environ.get("VECTOR_INDEX_MMAP", "0") == "1"
+# Compact local index: "float16" or "int8" scans a compressed copy of the vectors and re-ranks the best
+# k * VECTOR_RERANK_FACTOR rows exactly. The float32 rows are then always persisted and memory-mapped,
+# so only the compact copy stays in RAM. "float32" = exact scan only
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", "float32")
+VECTOR_RERANK_FACTOR = int(os.environ.get("VECTOR_RERANK_FACTOR", "4"))
+
+# /chat answer cache (per namespace, cleared when the corpus changes). With ANSWER_CACHE_SEMANTIC=1 a
+# question whose embedding is at least ANSWER_CACHE_SIMILARITY cosine-similar to a cached one reuses its answer
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_SEMANTIC = os.environ.get("ANSWER_CACHE_SEMANTIC", "0") == "1"
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Wikipedia fallback: lookups (including "no result") are cached on disk for the TTLs below.
+# WIKI_FETCHER="offline" serves pages from WIKI_OFFLINE_DIR (<title>.txt files) instead of the network
+WIKI_CACHE_PATH = os.environ.get("WIKI_CACHE_PATH", "./wiki_cache.sqlite3")
+WIKI_CACHE_TTL = float(os.environ.get("WIKI_CACHE_TTL", str(7 * 24 * 3600)))
+WIKI_NEGATIVE_TTL = float(os.environ.get("WIKI_NEGATIVE_TTL", str(24 * 3600)))
+WIKI_FETCHER = os.environ.get("WIKI_FETCHER", "online")
+WIKI_OFFLINE_DIR = os.environ.get("WIKI_OFFLINE_DIR", "./wiki_offline")
+
+# Async LLM client: HTTP connection pool shared by concurrent requests, request timeout (s),
+# and the cap on a single retry backoff when the provider sends no Retry-After
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", "10"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "60"))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "30"))
+
+# Prompt token budgets. Token counts use a chars-per-token ratio that starts at TOKEN_CHARS_PER_TOKEN
+# and is recalibrated from the input token usage the provider reports for each call
+TOKEN_CHARS_PER_TOKEN = float(os.environ.get("TOKEN_CHARS_PER_TOKEN", "4.0"))
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", "1800"))
+SUMMARY_BATCH_TOKENS = int(os.environ.get("SUMMARY_BATCH_TOKENS", "1600"))
+
+# Load the embedder, vector store and default namespace in a background thread at startup,
+# so the first request does not pay for it (the server accepts connections either way)
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1") == "1"
+
+# Multi-worker deployments. EMBEDDING_SERVER="unix:/tmp/rag-embed.sock" or "tcp:127.0.0.1:8765" makes the
+# API workers send encodes to one shared `python -m app.embedding_server` process (one model in RAM,
+# micro-batched across workers); empty = load the model in-process. CHROMA_HOST points all workers at
+# one Chroma server instead of each opening ./chroma_db_storage directly
+EMBEDDING_SERVER = os.environ.get("EMBEDDING_SERVER", "")
+EMBED_SERVER_MAX_BATCH = int(os.environ.get("EMBED_SERVER_MAX_BATCH", "64"))
+EMBED_SERVER_MAX_WAIT_MS = float(os.environ.get("EMBED_SERVER_MAX_WAIT_MS", "5"))
+CHROMA_HOST = os.environ.get("CHROMA_HOST", "")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
+# Lock files and per-namespace corpus generation markers shared by the API workers of one host.
+# A generation marker names the live collection of its corpus: keep this directory with ./chroma_db_storage
+STORE_SYNC_DIR = os.environ.get("STORE_SYNC_DIR", "./store_sync")
+EMBED_MODEL_NAME = os.environ.get("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
+# Embedding backend: "torch" (PyTorch float32), "onnx" (ONNX Runtime; EMBED_ONNX_FILE selects e.g. an
+# int8 export) or "int8" (PyTorch with dynamically quantized Linear layers). Chunks already stored keep
+# their old vectors; re-ingest with mode=replace after switching. Check parity/speed with app.embed_bench
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+EMBED_ONNX_FILE = os.environ.get("EMBED_ONNX_FILE", "")
+EMBED_PARITY_MIN_OVERLAP = float(os.environ.get("EMBED_PARITY_MIN_OVERLAP", "0.9"))
+
+# Query-side micro-batching: chat-time encodes arriving within QUERY_BATCH_MAX_WAIT_MS of each other
+# (up to QUERY_BATCH_MAX texts) run as one model call. Ingestion already encodes in large batches
+QUERY_BATCHING = os.environ.get("QUERY_BATCHING", "1") == "1"
+QUERY_BATCH_MAX = int(os.environ.get("QUERY_BATCH_MAX", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.environ.get("QUERY_BATCH_MAX_WAIT_MS", "3"))
@@ -1,17 +1,24 @@
-import fitz  # PyMuPDF
-import pdfplumber
 import re
+import random
 import time
+import threading
 import traceback
-from typing import List, Dict, Any, Optional
-from sentence_transformers import SentenceTransformer
-from .config import llm_client
-import docx
-from pptx import Presentation
+from typing import List, Dict, Any, Optional, Iterator
+from email.utils import parsedate_to_datetime
+from .rate_limiter import provider_rate_limiter, estimate_tokens
+from .token_budget import token_estimator
+from .config import get_llm_client, LLM_BACKOFF_MAX, MODEL_CACHE_TTL, EXTRACT_MAX_WORKERS, PDF_PAGES_PER_TASK, PDF_MIN_PAGE_CHARS, EMBED_BATCH_SIZE
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from collections import deque
+from typing import Iterable
 import os
 import json
 import glob
-import wikipedia
+import hashlib
+import numpy as np
+from .wiki_cache import get_wiki_cache
 
 # --- LLM HELPER FUNCTIONS ---
 
@@ -29,10 +36,57 @@ def _extract_model_names(models_resp: Any) -> List[str]:
             names.append(str(mid))
     return names
 
+class ModelCatalogCache:
+    """
+    Process-wide cache of the provider's model catalog.
+    models.list() is only called again once the TTL expires or the cache is invalidated.
+    """
+    def __init__(self, ttl: float = MODEL_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._names: Optional[List[str]] = None
+        self._fetched_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_names(self) -> List[str]:
+        with self._lock:
+            if self._names is not None and (time.monotonic() - self._fetched_at) < self.ttl:
+                self.hits += 1
+                return self._names
+            self.misses += 1
+            # Fetch while holding the lock so concurrent misses cause a single round-trip
+            names = _extract_model_names(get_llm_client().models.list())
+            self._names = names
+            self._fetched_at = time.monotonic()
+            return names
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "cached_models": len(self._names) if self._names else 0,
+                "ttl_seconds": self.ttl,
+            }
+
+model_catalog_cache = ModelCatalogCache()
+
+def get_model_cache_stats() -> Dict[str, Any]:
+    return model_catalog_cache.stats()
+
 def pick_fallback_model(preferred: Optional[str] = None) -> Optional[str]:
     try:
-        models_resp = llm_client.models.list()
-        names = _extract_model_names(models_resp)
+        names = model_catalog_cache.get_names()
         if not names:
             return preferred or None
         if preferred and preferred in names:
@@ -91,48 +145,94 @@ def get_wikipedia_summary(query: str) -> str:
     """
     Searches Wikipedia for the query and returns a summary.
     Returns None if no page is found or an error occurs.
+    Lookups go through the persistent wiki cache (set get_wiki_cache().fetcher to swap the source).
     """
     try:
         # 1. Search for the best matching page title
-        search_results = wikipedia.search(query)
+        wiki_cache = get_wiki_cache()
+        search_results = wiki_cache.search(query)
         if not search_results:
             return None
-        
+
         # 2. Get the summary of the top result (first 3 sentences)
-        summary = wikipedia.summary(search_results[0], sentences=3)
-        return f"{summary}\n\n(Source: Wikipedia - {search_results[0]})"
-    except wikipedia.exceptions.DisambiguationError as e:
-        # If the term is too vague (e.g., "Python"), pick the first option
-        try:
-            summary = wikipedia.summary(e.options[0], sentences=3)
-            return f"{summary}\n\n(Source: Wikipedia - {e.options[0]})"
-        except:
+        summary = wiki_cache.summary(search_results[0], sentences=3)
+        if not summary:
             return None
+        return f"{summary}\n\n(Source: Wikipedia - {search_results[0]})"
     except Exception as e:
         print(f"Wikipedia Error: {e}")
         return None
 
+def classify_llm_error(e: Exception) -> Optional[str]:
+    """"model" (stale/unknown model -> refetch catalog), "retry" (rate limit / transient), or None (give up)."""
+    status = getattr(e, "status_code", None)
+    code = str(getattr(e, "code", "") or "").lower()
+    err_txt = str(e).lower()
+    # Status first: Groq's 429 text names the model ("Rate limit reached for model ..."), so a
+    # plain substring check would treat every rate limit as a stale catalog
+    if status in (408, 409, 429) or (isinstance(status, int) and status >= 500):
+        return "retry"
+    if status == 404 or code == "model_not_found" or "model_not_found" in err_txt or "decommissioned" in err_txt:
+        return "model"
+    if status is None and ("rate_limit" in err_txt or "too large" in err_txt):
+        return "retry"
+    if type(e).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return "retry"
+    return None
+
+def llm_retry_delay(e: Exception, attempt: int, backoff_base: float = 1.0) -> float:
+    """Seconds to wait before retrying: the provider's Retry-After if given, else capped exponential backoff with full jitter."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after") if hasattr(headers, "get") else None
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after).timestamp()
+                return min(max(0.0, when - time.time()), LLM_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, backoff_base * (2 ** attempt)))
+
+def observe_prompt_usage(prompt: str, resp: Any):
+    """Feeds the provider's billed input tokens back into the token estimator."""
+    usage = getattr(resp, "usage", None)
+    token_estimator.observe(prompt, getattr(usage, "input_tokens", None))
+
+def is_rate_limited(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429 or "rate_limit" in str(e).lower()
+
 def call_llm_summarize(prompt: str, max_tokens: int = 1024, model: Optional[str] = None, temperature: float = 0.0, stop: Optional[List[str]] = None, retry: int = 1, backoff_base: float = 1.0) -> Dict[str, Any]:
     chosen = pick_fallback_model(model)
     last_tb = None
     for attempt in range(0, retry + 1):
+        # Every attempt is admitted by the shared scheduler (priority from llm_priority_scope)
+        provider_rate_limiter.acquire(estimate_tokens(prompt) + max_tokens)
         try:
             call_kwargs: Dict[str, Any] = {"model": chosen, "input": prompt, "max_output_tokens": max_tokens, "temperature": temperature}
             if stop: call_kwargs["stop"] = stop
-            resp = llm_client.responses.create(**call_kwargs)
+            resp = get_llm_client().responses.create(**call_kwargs)
+            observe_prompt_usage(prompt, resp)
             text = _extract_text_from_response(resp)
             return {"ok": True, "text": text, "resp": resp}
         except Exception as e:
             last_tb = traceback.format_exc()
-            err_txt = str(e).lower()
-            if any(token in err_txt for token in ("model", "not found", "decommissioned", "invalid_request", "unsupported")):
+            kind = classify_llm_error(e)
+            if kind is None:
+                return {"ok": False, "text": None, "resp": last_tb}
+            if kind == "model":
+                # The cached catalog may be stale (model removed/decommissioned) -> refetch
+                model_catalog_cache.invalidate()
                 chosen = pick_fallback_model(None)
-                time.sleep(backoff_base * (2 ** attempt))
-                continue
-            if "rate_limit" in err_txt or "tokens" in err_txt or "too large" in err_txt:
-                time.sleep(backoff_base * (2 ** attempt))
-                continue
-            return {"ok": False, "text": None, "resp": last_tb}
+            if attempt < retry:
+                delay = llm_retry_delay(e, attempt, backoff_base)
+                if is_rate_limited(e):
+                    # Pause the whole queue instead of letting every caller hit the 429 on its own
+                    provider_rate_limiter.backoff(delay)
+                else:
+                    time.sleep(delay)
     return {"ok": False, "text": None, "resp": last_tb}
 
 def call_llm_text_only(prompt: str, max_tokens: int, temperature: float) -> str:
@@ -147,14 +247,44 @@ def call_llm_answer(prompt_text: str, max_tokens: int = 512, temperature: float
         return out["text"]
     return str(out)
 
+def stream_llm_text(prompt: str, max_tokens: int = 512, temperature: float = 0.0, model: Optional[str] = None, retry: int = 1, backoff_base: float = 1.0) -> Iterator[str]:
+    """Yields answer text deltas as they arrive from the provider's streaming Responses API."""
+    chosen = pick_fallback_model(model)
+    # One scheduler slot for the whole answer: a request the provider rejected consumed no quota,
+    # so a retry waits out its backoff instead of queueing for a second slot
+    provider_rate_limiter.acquire(estimate_tokens(prompt) + max_tokens)
+    for attempt in range(0, retry + 1):
+        try:
+            stream = get_llm_client().responses.create(model=chosen, input=prompt, max_output_tokens=max_tokens, temperature=temperature, stream=True)
+            break
+        except Exception as e:
+            kind = classify_llm_error(e)
+            if kind is None or attempt >= retry:
+                print(f"LLM stream failed: {e}")
+                return
+            if kind == "model":
+                # The cached catalog may be stale (model removed/decommissioned) -> refetch
+                model_catalog_cache.invalidate()
+                chosen = pick_fallback_model(None)
+                continue
+            delay = llm_retry_delay(e, attempt, backoff_base)
+            if is_rate_limited(e):
+                # Pause the whole queue instead of letting every caller hit the 429 on its own
+                provider_rate_limiter.backoff(delay)
+            time.sleep(delay)
+    for event in stream:
+        event_type = getattr(event, "type", "")
+        if event_type == "response.output_text.delta":
+            delta = getattr(event, "delta", "")
+            if delta:
+                yield delta
+        elif event_type == "response.completed":
+            observe_prompt_usage(prompt, getattr(event, "response", None))
+
 # ... existing imports ...
 
-def generate_multi_queries(original_question: str, call_llm_fn, n_versions: int = 3) -> List[str]:
-    """
-    Asks the LLM to generate 'n_versions' of the user's question
-    from different perspectives to improve retrieval coverage.
-    """
-    prompt = f"""
+def _multi_query_prompt(original_question: str, n_versions: int) -> str:
+    return f"""
     You are an AI language model assistant. Your task is to generate {n_versions} different versions of the given user question to retrieve relevant documents from a vector database. 
     By generating multiple perspectives on the user question, your goal is to help the user overcome some of the limitations of the distance-based similarity search. 
     
@@ -162,54 +292,79 @@ def generate_multi_queries(original_question: str, call_llm_fn, n_versions: int
     
     Provide these alternative questions separated by newlines. Do not number them.
     """
-    
-    # 1. Get response from LLM
-    # We use a slightly higher temperature (0.7) to encourage creativity/variety
-    response_text = call_llm_fn(prompt, max_tokens=256, temperature=0.7)
-    
-    # 2. Clean and split the response into a list
-    variations = [line.strip() for line in response_text.split('\n') if line.strip()]
-    
+
+def _parse_multi_queries(original_question: str, response_text: Optional[str]) -> List[str]:
+    # Clean and split the response into a list
+    # (the LLM helpers return None / "" when the call failed: no variations then)
+    variations = [line.strip() for line in (response_text or "").split('\n') if line.strip()]
     # Return the original question + the new variations
     return [original_question] + variations
 
+def generate_multi_queries(original_question: str, call_llm_fn, n_versions: int = 3) -> List[str]:
+    """
+    Asks the LLM to generate 'n_versions' of the user's question
+    from different perspectives to improve retrieval coverage.
+    """
+    # We use a slightly higher temperature (0.7) to encourage creativity/variety
+    response_text = call_llm_fn(_multi_query_prompt(original_question, n_versions), max_tokens=256, temperature=0.7)
+    return _parse_multi_queries(original_question, response_text)
+
+async def agenerate_multi_queries(original_question: str, acall_llm_fn, n_versions: int = 3) -> List[str]:
+    """generate_multi_queries with an awaited LLM call (retry waits don't hold a worker thread)."""
+    response_text = await acall_llm_fn(_multi_query_prompt(original_question, n_versions), max_tokens=256, temperature=0.7)
+    return _parse_multi_queries(original_question, response_text)
+
 # --- PDF & DB HELPER FUNCTIONS ---
 
-# --- IMPORTS FOR NEW FORMATS ---
-import docx
-from pptx import Presentation
+# Format libraries (PyMuPDF, pdfplumber, python-docx, python-pptx) are imported inside the
+# extractors: they are only needed while ingesting, mostly in the extraction worker processes.
 
 # ... (Keep your existing Imports and LLM Helper Functions at the top) ...
 
 # --- UNIVERSAL FILE PROCESSING FUNCTIONS ---
 
-def extract_text_from_pdf_selectable(path: str) -> List[Dict[str, Any]]:
-    # ... (Keep your existing PDF extraction code exactly as is) ...
+def extract_pdf_page_range(path: str, start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Extracts pages [start, end) with PyMuPDF. Only pages where it finds almost no text
+    (scanned / odd encodings) are re-read with the slower pdfplumber.
+    """
+    import fitz  # PyMuPDF
     pages = []
     try:
         doc = fitz.open(path)
-        for i, page in enumerate(doc):
-            text = page.get_text("text") or ""
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for i in range(start, end):
+            text = doc.load_page(i).get_text("text") or ""
             pages.append({"page_number": i + 1, "pdf_text": text})
         doc.close()
-        # Fallback logic...
-        total_chars = sum(len(p["pdf_text"]) for p in pages)
-        if total_chars < 50:
-            raise ValueError("PyMuPDF returned very little text")
-        return pages
     except Exception:
-        # Fallback to pdfplumber
         pages = []
-        with pdfplumber.open(path) as pdf:
-            for i, p in enumerate(pdf.pages):
-                try: text = p.extract_text() or ""
-                except Exception: text = ""
-                pages.append({"page_number": i + 1, "pdf_text": text})
+
+    weak = [p for p in pages if len(p["pdf_text"].strip()) < PDF_MIN_PAGE_CHARS]
+    if pages and not weak:
         return pages
 
+    # Fallback to pdfplumber (whole range if PyMuPDF failed, otherwise just the weak pages)
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        if not pages:
+            end = len(pdf.pages) if end is None else min(end, len(pdf.pages))
+            pages = [{"page_number": i + 1, "pdf_text": ""} for i in range(start, end)]
+            weak = pages
+        for p in weak:
+            try: text = pdf.pages[p["page_number"] - 1].extract_text() or ""
+            except Exception: text = ""
+            if len(text.strip()) > len(p["pdf_text"].strip()):
+                p["pdf_text"] = text
+    return pages
+
+def extract_text_from_pdf_selectable(path: str) -> List[Dict[str, Any]]:
+    return extract_pdf_page_range(path)
+
 def extract_text_from_docx(path: str) -> List[Dict[str, Any]]:
     """Reads Word files. Treats the whole document as 'Page 1' for simplicity."""
     try:
+        import docx
         doc = docx.Document(path)
         full_text = []
         for para in doc.paragraphs:
@@ -224,6 +379,7 @@ def extract_text_from_docx(path: str) -> List[Dict[str, Any]]:
 def extract_text_from_pptx(path: str) -> List[Dict[str, Any]]:
     """Reads PPTX files. Maps Slides to Pages."""
     try:
+        from pptx import Presentation
         prs = Presentation(path)
         pages = []
         for i, slide in enumerate(prs.slides):
@@ -251,6 +407,115 @@ def extract_text_universal(path: str) -> List[Dict[str, Any]]:
     else:
         raise ValueError(f"Unsupported file format: {ext}")
 
+def _pdf_page_count(path: str) -> int:
+    try:
+        import fitz
+        with fitz.open(path) as doc:
+            return doc.page_count
+    except Exception:
+        return 0
+
+def _run_extract_task(task):
+    kind, path, start, end = task
+    if kind == "pdf_range":
+        return extract_pdf_page_range(path, start, end)
+    return extract_text_universal(path)
+
+def _plan_extract_tasks(paths: List[str], pages_per_task: int) -> List[tuple]:
+    tasks = []
+    for path in paths:
+        n_pages = _pdf_page_count(path) if os.path.splitext(path)[1].lower() == ".pdf" else 0
+        if n_pages > pages_per_task:
+            tasks.extend(("pdf_range", path, s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task))
+        else:
+            tasks.append(("file", path, 0, None))
+    return tasks
+
+# One long-lived extraction pool per server process. Workers are spawned, not forked: the server
+# has live threads (torch, batchers, job workers, HTTP pools) that a forked child would inherit mid-state
+_extract_pool: Optional[ProcessPoolExecutor] = None
+_extract_pool_lock = threading.Lock()
+
+def get_extract_pool() -> ProcessPoolExecutor:
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=max(1, EXTRACT_MAX_WORKERS), mp_context=multiprocessing.get_context("spawn"))
+        return _extract_pool
+
+def shutdown_extract_pool(broken: bool = False):
+    """Stops the extraction workers (server shutdown, or a pool broken by a crashed worker)."""
+    global _extract_pool
+    with _extract_pool_lock:
+        pool, _extract_pool = _extract_pool, None
+    if pool is not None:
+        pool.shutdown(wait=not broken, cancel_futures=True)
+
+def iter_extract_parallel(paths: List[str], max_workers: int = EXTRACT_MAX_WORKERS, pages_per_task: int = PDF_PAGES_PER_TASK, progress_fn=None) -> Iterator[tuple]:
+    """
+    Extracts files on a process pool and yields (path, pages) per task in file/page order
+    (pages is an Exception if that task failed). Large PDFs are split into page ranges so a single
+    big file is spread across cores too. Only a small window of tasks is in flight, so finished
+    results don't pile up in memory ahead of the consumer.
+    """
+    tasks = _plan_extract_tasks(paths, pages_per_task)
+    last_task_of = {task[1]: i for i, task in enumerate(tasks)}
+    finished_files = 0
+
+    def _finished(i, task):
+        nonlocal finished_files
+        if last_task_of[task[1]] == i:
+            finished_files += 1
+            if progress_fn: progress_fn("extract", finished_files, len(paths))
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        for i, task in enumerate(tasks):
+            try: result = _run_extract_task(task)
+            except Exception as e: result = e
+            yield task[1], result
+            _finished(i, task)
+        return
+
+    window = max_workers * 2
+    pool = get_extract_pool()
+    queue = deque()
+    next_task = 0
+    try:
+        while next_task < len(tasks) and len(queue) < window:
+            queue.append((next_task, pool.submit(_run_extract_task, tasks[next_task])))
+            next_task += 1
+        while queue:
+            i, fut = queue.popleft()
+            try: result = fut.result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. OOM on a huge PDF): start a fresh pool for the next upload
+                shutdown_extract_pool(broken=True)
+                result = e
+            except Exception as e: result = e
+            if next_task < len(tasks):
+                try:
+                    queue.append((next_task, pool.submit(_run_extract_task, tasks[next_task])))
+                except (BrokenProcessPool, RuntimeError) as e:
+                    failed = Future()
+                    failed.set_exception(e)
+                    queue.append((next_task, failed))
+                next_task += 1
+            yield tasks[i][1], result
+            _finished(i, tasks[i])
+    finally:
+        # The pool outlives this upload; just drop work the consumer no longer wants
+        for _, fut in queue:
+            fut.cancel()
+
+def extract_files_parallel(paths: List[str], max_workers: int = EXTRACT_MAX_WORKERS, pages_per_task: int = PDF_PAGES_PER_TASK, progress_fn=None) -> Dict[str, Any]:
+    """Collecting form of iter_extract_parallel: {path: pages} (or {path: exception} on failure)."""
+    out: Dict[str, Any] = {path: [] for path in paths}
+    for path, pages in iter_extract_parallel(paths, max_workers, pages_per_task, progress_fn):
+        if isinstance(out[path], Exception):
+            continue
+        out[path] = pages if isinstance(pages, Exception) else out[path] + pages
+    return out
+
 def preprocess_for_llm(text: str) -> str:
     text = re.sub(r'(\w)-\n(\w)', r'\1\2', text)
     text = re.sub(r'(?<!\n)\n(?!\n)', ' ', text)
@@ -281,18 +546,201 @@ def simple_chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) ->
         if end >= text_len: break
     return chunks
 
-def upsert_chunks_to_chroma(chunks: List[Dict[str, Any]], embed_model: SentenceTransformer, collection):
+def iter_chunk_pages(pages: Iterable[Dict[str, Any]], chunk_size: int = 1000, overlap: int = 200) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming equivalent of simple_chunk_text(build_combined_document(pages)["combined_text"]).
+    Pages are cleaned one at a time and only the not-yet-chunked tail is buffered, so memory
+    stays bounded by a page + a chunk instead of the whole document.
+    Each chunk also gets page_start/page_end: the pages its first and last character fall on.
+    A page's optional "label" is used for the in-text page marker instead of its number.
+    """
+    buf = ""          # combined text from absolute offset buf_start onwards
+    buf_start = 0
+    total = 0         # absolute length of the combined text seen so far
+    start = 0         # absolute start of the next chunk
+    last_end = -1
+    chunk_id = 0
+    page_marks = deque()  # (absolute offset where the page's text starts, page number)
+
+    def _page_at(x: int):
+        page = page_marks[0][1]
+        for offset, number in page_marks:
+            if offset > x: break
+            page = number
+        return page
+
+    def _emit(s: int, e: int):
+        nonlocal chunk_id
+        chunk_text = buf[s - buf_start:e - buf_start].strip()
+        if chunk_text:
+            chunk = {"id": f"chunk_{chunk_id}", "text": chunk_text, "start_char": s, "end_char": e,
+                     "page_start": _page_at(s), "page_end": _page_at(max(s, e - 1))}
+            chunk_id += 1
+            return chunk
+        return None
+
+    for n, p in enumerate(pages):
+        cleaned = preprocess_for_llm(p["pdf_text"] or "")
+        sep = "\n\n" if n else ""
+        segment = sep + f"--- PAGE {p.get('label', p['page_number'])} ---\n{cleaned}"
+        page_marks.append((total + len(sep), p["page_number"]))
+        buf += segment
+        total += len(segment)
+        while start + chunk_size <= total:
+            end = start + chunk_size
+            chunk = _emit(start, end)
+            if chunk: yield chunk
+            last_end = end
+            start = max(end - overlap, 0)
+        # Drop text no future chunk can reach
+        if start > buf_start:
+            buf = buf[start - buf_start:]
+            buf_start = start
+        while len(page_marks) > 1 and page_marks[1][0] <= start:
+            page_marks.popleft()
+
+    if last_end == total:
+        return
+    while start < total:
+        end = min(start + chunk_size, total)
+        chunk = _emit(start, end)
+        if chunk: yield chunk
+        start = max(end - overlap, 0)
+        if end >= total: break
+
+def file_content_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def iter_document_chunks(pages: Iterable[Dict[str, Any]], doc_hash: str, doc_index: int = 0, source_file: str = "") -> Iterator[Dict[str, Any]]:
+    """Chunks a single document; chunk ids/metadata are derived from the document and chunk content hashes."""
+    for i, c in enumerate(iter_chunk_pages(pages)):
+        c["id"] = f"{doc_hash[:16]}_{i}"
+        c["doc_hash"] = doc_hash
+        c["chunk_hash"] = text_hash(c["text"])
+        c["doc_index"] = doc_index
+        c["source_file"] = source_file
+        yield c
+
+def chunk_document(pages: List[Dict[str, Any]], doc_hash: str, doc_index: int = 0, source_file: str = "") -> List[Dict[str, Any]]:
+    return list(iter_document_chunks(pages, doc_hash, doc_index, source_file))
+
+def get_doc_hash_index(collection) -> Dict[Optional[str], List[str]]:
+    """Maps doc_hash -> chunk ids currently stored (chunks without a doc_hash are grouped under None)."""
+    index: Dict[Optional[str], List[str]] = {}
+    try:
+        res = collection.get(include=["metadatas"])
+    except Exception as e:
+        print("Warning: collection.get() failed:", str(e))
+        return index
+    for cid, meta in zip(res.get("ids") or [], res.get("metadatas") or []):
+        index.setdefault((meta or {}).get("doc_hash"), []).append(cid)
+    return index
+
+def _lookup_embeddings_by_chunk_hash(collection, hashes: List[str]) -> Dict[str, np.ndarray]:
+    found: Dict[str, np.ndarray] = {}
+    if not hashes:
+        return found
+    try:
+        res = collection.get(where={"chunk_hash": {"$in": list(set(hashes))}}, include=["metadatas", "embeddings"])
+    except Exception as e:
+        print("Warning: embedding lookup failed:", str(e))
+        return found
+    embs = res.get("embeddings")
+    if embs is None:
+        return found
+    embs = np.asarray(embs, dtype=np.float32)
+    for meta, emb in zip(res.get("metadatas") or [], embs):
+        h = (meta or {}).get("chunk_hash")
+        if h and h not in found:
+            found[h] = emb
+    return found
+
+# Structured per-chunk metadata stored next to the char offsets (filterable with `where`)
+CHUNK_METADATA_KEYS = ("doc_hash", "chunk_hash", "doc_index", "source_file", "page_start", "page_end")
+
+def upsert_chunks_to_chroma(chunks: List[Dict[str, Any]], embed_model, collection, reuse_from=None, progress_fn=None, encode_batch_size: int = 64):
+    """
+    Encodes and upserts chunks. With reuse_from (a collection), chunks whose text hash is already
+    stored there keep that embedding and only the new texts go through the encoder.
+    progress_fn(stage, done, total) is called as encoding/upserting advances.
+    Returns the number of chunks that were actually encoded.
+    """
+    if not chunks:
+        return 0
     texts = [c["text"] for c in chunks]
     ids = [c["id"] for c in chunks]
-    metadatas = [{"start_char": c["start_char"], "end_char": c["end_char"]} for c in chunks]
-    embeddings = embed_model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
-    emb_list = [emb.tolist() for emb in embeddings]
-    collection.add(ids=ids, documents=texts, metadatas=metadatas, embeddings=emb_list)
-    return collection
+    metadatas = []
+    for c in chunks:
+        meta = {"start_char": c["start_char"], "end_char": c["end_char"]}
+        for key in CHUNK_METADATA_KEYS:
+            if key in c:
+                meta[key] = c[key]
+        metadatas.append(meta)
+
+    known = _lookup_embeddings_by_chunk_hash(reuse_from, [c.get("chunk_hash") for c in chunks if c.get("chunk_hash")]) if reuse_from is not None else {}
+    to_encode = [i for i, c in enumerate(chunks) if c.get("chunk_hash") not in known]
+    # One contiguous float32 array for the whole batch: no per-element Python floats on the way to Chroma
+    emb_matrix = np.empty((len(chunks), embed_model.get_sentence_embedding_dimension()), dtype=np.float32)
+    for i, c in enumerate(chunks):
+        if c.get("chunk_hash") in known:
+            emb_matrix[i] = known[c["chunk_hash"]]
+    for b in range(0, len(to_encode), encode_batch_size):
+        batch_idx = to_encode[b:b + encode_batch_size]
+        emb_matrix[batch_idx] = embed_model.encode([texts[i] for i in batch_idx], convert_to_numpy=True)
+        if progress_fn: progress_fn("embed", min(b + encode_batch_size, len(to_encode)), len(to_encode))
+    if progress_fn: progress_fn("upsert", 0, len(chunks))
+    collection.upsert(ids=ids, documents=texts, metadatas=metadatas, embeddings=emb_matrix)
+    if progress_fn: progress_fn("upsert", len(chunks), len(chunks))
+    return len(to_encode)
+
+def upsert_chunk_stream(chunks: Iterable[Dict[str, Any]], embed_model, collection, batch_size: int = EMBED_BATCH_SIZE, reuse_from=None, progress_fn=None) -> Dict[str, int]:
+    """Consumes a chunk generator in fixed-size batches (encode + upsert per batch)."""
+    totals = {"chunks": 0, "encoded": 0}
+    batch: List[Dict[str, Any]] = []
+
+    def _flush():
+        # Per-batch progress made cumulative; totals grow while documents are still being chunked
+        encoded_before, chunks_before = totals["encoded"], totals["chunks"]
+
+        def _batch_progress(stage, done, total):
+            base = encoded_before if stage == "embed" else chunks_before
+            progress_fn(stage, base + done, base + total)
+
+        totals["encoded"] += upsert_chunks_to_chroma(batch, embed_model, collection, reuse_from=reuse_from, progress_fn=_batch_progress if progress_fn else None, encode_batch_size=batch_size)
+        totals["chunks"] += len(batch)
+        if progress_fn: progress_fn("upsert", totals["chunks"], totals["chunks"], embedded=totals["encoded"], reused=totals["chunks"] - totals["encoded"])
+        batch.clear()
 
-def get_all_chunks_from_collection(collection):
+    for c in chunks:
+        batch.append(c)
+        if len(batch) >= batch_size:
+            _flush()
+    if batch:
+        _flush()
+    return totals
+
+def copy_chunks(src_collection, dst_collection, ids: List[str], metadata_update: Optional[Dict[str, Any]] = None) -> int:
+    """Copies stored chunks (text, metadata, embedding) between collections without re-encoding."""
+    if not ids:
+        return 0
+    res = src_collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+    if not res.get("ids"):
+        return 0
+    metas = [dict(m or {}, **(metadata_update or {})) for m in res.get("metadatas") or []]
+    dst_collection.upsert(ids=res["ids"], documents=res["documents"], metadatas=metas, embeddings=np.asarray(res["embeddings"], dtype=np.float32))
+    return len(res["ids"])
+
+def get_all_chunks_from_collection(collection, where: Optional[Dict[str, Any]] = None):
     try:
-        res = collection.get(include=["documents", "metadatas", "embeddings"])
+        # Embeddings are not needed by the summary / quiz callers, so they are not pulled back
+        res = collection.get(where=where, include=["documents", "metadatas"]) if where else collection.get(include=["documents", "metadatas"])
         ids = res.get("ids")
         docs = res.get("documents", [])
         metas = res.get("metadatas", [])
@@ -310,6 +758,23 @@ def get_all_chunks_from_collection(collection):
         print("Warning: collection.get() failed:", str(e))
         return []
 
+def collection_fingerprint(collection) -> str:
+    """Stable hash of the collection contents (ids + documents), independent of storage order."""
+    try:
+        res = collection.get(include=["documents"])
+    except Exception as e:
+        print("Warning: collection.get() failed:", str(e))
+        return ""
+    ids = res.get("ids") or []
+    docs = res.get("documents") or []
+    h = hashlib.sha256()
+    for cid, doc in sorted(zip(ids, docs)):
+        h.update(str(cid).encode("utf-8"))
+        h.update(b"\x00")
+        h.update((doc or "").encode("utf-8"))
+        h.update(b"\x01")
+    return h.hexdigest()
+
 # --- SUMMARY STORAGE HELPERS ---
 SUMMARY_STORAGE_DIR = "saved_summaries"
 os.makedirs(SUMMARY_STORAGE_DIR, exist_ok=True)
@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, List
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent encode calls into one model call.
+    The first waiting request opens a batch; requests arriving within max_wait_ms are added until
+    max_batch texts are collected, then the whole batch is encoded at once and the rows are
+    handed back to each caller. encode() blocks the calling thread until its rows are ready.
+    """
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch: int = 64, max_wait_ms: float = 5.0, name: str = "embed-batcher"):
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.encode_seconds = 0.0
+        self.started_at = time.monotonic()
+        # Submit-to-result latency of the most recent requests, for the percentiles in stats()
+        self._latencies: deque = deque(maxlen=1000)
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        request = {"texts": list(texts), "done": threading.Event(), "result": None, "error": None, "submitted": time.monotonic()}
+        self._queue.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def _collect(self) -> List[Dict[str, Any]]:
+        batch = [self._queue.get()]
+        n_texts = len(batch[0]["texts"])
+        deadline = time.monotonic() + self.max_wait
+        while n_texts < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_texts += len(request["texts"])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [t for request in batch for t in request["texts"]]
+            started = time.monotonic()
+            try:
+                vectors = np.asarray(self.encode_fn(texts), dtype=np.float32).reshape(len(texts), -1) if texts else None
+                offset = 0
+                for request in batch:
+                    n = len(request["texts"])
+                    request["result"] = vectors[offset:offset + n] if n else np.zeros((0, 0), dtype=np.float32)
+                    offset += n
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+            finished = time.monotonic()
+            with self._stats_lock:
+                self.encode_seconds += finished - started
+                self._latencies.extend(finished - request["submitted"] for request in batch)
+                self.batches += 1
+                self.requests += len(batch)
+                self.items += len(texts)
+                self.largest_batch = max(self.largest_batch, len(texts))
+            for request in batch:
+                request["done"].set()
+
+    @staticmethod
+    def _percentile(ordered: List[float], q: float) -> float:
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            uptime = max(time.monotonic() - self.started_at, 1e-9)
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self.batches,
+                "requests": self.requests,
+                "items": self.items,
+                "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "queued": self._queue.qsize(),
+                # items/s while the model is busy vs. averaged over the batcher's lifetime
+                "encode_items_per_sec": round(self.items / self.encode_seconds, 1) if self.encode_seconds else 0.0,
+                "items_per_sec": round(self.items / uptime, 3),
+                "latency_ms": {
+                    "p50": round(self._percentile(latencies, 0.50) * 1000.0, 2),
+                    "p95": round(self._percentile(latencies, 0.95) * 1000.0, 2),
+                    "max": round(latencies[-1] * 1000.0, 2) if latencies else 0.0,
+                    "window": len(latencies),
+                },
+            }
+
+
+class BatchedEncoder:
+    """
+    SentenceTransformer-shaped wrapper that sends encode() calls through a MicroBatcher, so
+    concurrent single-question encodes from chat requests become one model call.
+    Everything else (dimension, cache stats, ...) is delegated to the wrapped embedder.
+    """
+    def __init__(self, embedder, max_batch: int = 32, max_wait_ms: float = 3.0):
+        self.embedder = embedder
+        self.batcher = MicroBatcher(
+            lambda texts: embedder.encode(texts, convert_to_numpy=True),
+            max_batch=max_batch, max_wait_ms=max_wait_ms, name="query-batcher"
+        )
+
+    def encode(self, sentences, convert_to_numpy: bool = True, normalize_embeddings: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        out = self.batcher.encode([sentences] if single else list(sentences))
+        if normalize_embeddings and len(out):
+            out = out / np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        if single:
+            out = out[0]
+        return out if convert_to_numpy else out.tolist()
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
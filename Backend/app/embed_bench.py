@@ -0,0 +1,134 @@
+"""
+Compares embedding backends on real course material.
+
+    python -m app.embed_bench lecture1.pdf notes.docx --backends torch,onnx,int8 --k 5 --min-overlap 0.9
+
+For every backend (each in a fresh process, so memory figures are not polluted by the others) it
+reports load time, chunks/sec and resident memory. Then it checks retrieval parity against the
+first backend: top-k chunk overlap per query, averaged. The exit status is 1 if any backend
+falls below --min-overlap.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .config import EMBED_PARITY_MIN_OVERLAP
+
+
+def _rss_mb() -> float:
+    """Current resident set size (Linux /proc), falling back to the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def load_sample_chunks(paths: List[str], limit: Optional[int] = None) -> List[str]:
+    """Chunk texts exactly as ingestion produces them."""
+    from .core_utils import extract_text_universal, iter_chunk_pages
+    texts = []
+    for path in paths:
+        texts.extend(c["text"] for c in iter_chunk_pages(extract_text_universal(path)))
+    return texts[:limit] if limit else texts
+
+def sample_queries(texts: List[str], n: int = 50) -> List[str]:
+    """Question-sized probes: the opening sentence of evenly spaced chunks."""
+    step = max(1, len(texts) // max(1, n))
+    return [t.strip().split(". ")[0][:200] for t in texts[::step][:n] if t.strip()]
+
+def benchmark_backend(backend: str, texts: List[str], queries: List[str], batch_size: int = 64) -> Dict[str, Any]:
+    """Loads one backend and encodes the corpus and queries. Meant to run in its own process."""
+    from .embedders import make_embedder
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    embedder = make_embedder(backend)
+    load_seconds = time.perf_counter() - started
+    embedder.encode(texts[:batch_size], convert_to_numpy=True, batch_size=batch_size)   # warm-up
+
+    started = time.perf_counter()
+    corpus = np.asarray(embedder.encode(texts, convert_to_numpy=True, batch_size=batch_size), dtype=np.float32)
+    encode_seconds = time.perf_counter() - started
+    query_embs = np.asarray(embedder.encode(queries, convert_to_numpy=True, batch_size=batch_size), dtype=np.float32)
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "chunks": len(texts),
+        "encode_seconds": round(encode_seconds, 2),
+        "chunks_per_sec": round(len(texts) / encode_seconds, 1) if encode_seconds else 0.0,
+        "rss_mb": round(_rss_mb(), 1),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 1),
+        "corpus": corpus,
+        "queries": query_embs,
+    }
+
+def _top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    corpus = corpus / np.clip(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12, None)
+    queries = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+def topk_overlap(baseline: Dict[str, Any], candidate: Dict[str, Any], k: int = 5) -> Dict[str, float]:
+    """Share of the baseline's top-k chunks that the candidate also retrieves (1.0 = identical sets)."""
+    k = min(k, len(baseline["corpus"]))
+    if not k or not len(baseline["queries"]):
+        return {"mean": 1.0, "min": 1.0}
+    base = _top_k(baseline["corpus"], baseline["queries"], k)
+    cand = _top_k(candidate["corpus"], candidate["queries"], k)
+    overlaps = [len(set(b) & set(c)) / k for b, c in zip(base.tolist(), cand.tolist())]
+    return {"mean": round(float(np.mean(overlaps)), 4), "min": round(float(np.min(overlaps)), 4)}
+
+def compare_backends(backends: List[str], texts: List[str], queries: List[str], k: int = 5, min_overlap: float = EMBED_PARITY_MIN_OVERLAP, batch_size: int = 64) -> Dict[str, Any]:
+    results = []
+    for backend in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results.append(pool.submit(benchmark_backend, backend, texts, queries, batch_size).result())
+
+    baseline = results[0]
+    report = {"baseline": baseline["backend"], "k": k, "min_overlap": min_overlap, "backends": [], "passed": True}
+    for r in results:
+        row = {key: v for key, v in r.items() if key not in ("corpus", "queries")}
+        if r is not baseline:
+            overlap = topk_overlap(baseline, r, k)
+            row["topk_overlap"] = overlap
+            row["parity_ok"] = overlap["mean"] >= min_overlap
+            report["passed"] = report["passed"] and row["parity_ok"]
+        report["backends"].append(row)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .embedders import available_backends
+    parser = argparse.ArgumentParser(description="Benchmark and parity-check embedding backends")
+    parser.add_argument("files", nargs="+", help="PDF / DOCX / PPTX files to chunk and embed")
+    parser.add_argument("--backends", default="torch,onnx,int8", help=f"comma-separated, first is the baseline ({', '.join(available_backends())})")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--min-overlap", type=float, default=EMBED_PARITY_MIN_OVERLAP)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=None, help="max chunks to embed")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    texts = load_sample_chunks(args.files, args.limit)
+    if not texts:
+        print("No text extracted from the given files.")
+        return 1
+    queries = sample_queries(texts, args.queries)
+    report = compare_backends([b.strip() for b in args.backends.split(",") if b.strip()], texts, queries, k=args.k, min_overlap=args.min_overlap, batch_size=args.batch_size)
+
+    print(f"{len(texts)} chunks, {len(queries)} queries, top-{report['k']} parity vs {report['baseline']} (min {report['min_overlap']})")
+    for row in report["backends"]:
+        parity = row.get("topk_overlap")
+        parity_text = f"overlap mean {parity['mean']:.3f} min {parity['min']:.3f} {'OK' if row['parity_ok'] else 'FAIL'}" if parity else "baseline"
+        print(f"  {row['backend']:<6} {row['chunks_per_sec']:>8.1f} chunks/s  load {row['load_seconds']:>5.1f}s  rss {row['rss_mb']:>7.1f} MB (+{row['rss_delta_mb']:.1f})  {parity_text}")
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import importlib
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List
+
+from .config import EMBED_MODEL_NAME, EMBED_BACKEND, EMBED_ONNX_FILE
+
+
+def _require(module: str, package: str, backend: str):
+    """Fails with the package to install when an optional backend's dependency is missing."""
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        raise ImportError(f"EMBED_BACKEND={backend!r} needs {package}: pip install \"{package}\"") from None
+
+
+class Embedder(ABC):
+    """
+    Sentence embedding backend. encode() has the SentenceTransformer call shape the engines use
+    (a string gives one vector, a list gives a matrix). `cache_name` keys the persistent
+    embedding cache, so vectors from different backends never mix there.
+    """
+    backend = "base"
+
+    def __init__(self, model_name: str = EMBED_MODEL_NAME):
+        self.model_name = model_name
+        self.model = self._load()
+
+    @property
+    def cache_name(self) -> str:
+        return self.model_name
+
+    @abstractmethod
+    def _load(self):
+        """Returns the loaded model; must provide encode() and get_sentence_embedding_dimension()."""
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, sentences, convert_to_numpy: bool = True, **kwargs):
+        return self.model.encode(sentences, convert_to_numpy=convert_to_numpy, **kwargs)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "model": self.model_name, "dim": self.get_sentence_embedding_dimension()}
+
+
+class TorchEmbedder(Embedder):
+    """The original PyTorch SentenceTransformer (float32)."""
+    backend = "torch"
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name)
+
+
+class OnnxEmbedder(Embedder):
+    """
+    ONNX Runtime inference through sentence-transformers' onnx backend (needs optimum[onnxruntime]).
+    EMBED_ONNX_FILE picks a specific export inside the model repo, e.g. "onnx/model_qint8_avx512_vnni.onnx"
+    for the int8-quantized one; empty = the default model.onnx (exported on first load if missing).
+    """
+    backend = "onnx"
+
+    def __init__(self, model_name: str = EMBED_MODEL_NAME, file_name: str = EMBED_ONNX_FILE):
+        self.file_name = file_name
+        super().__init__(model_name)
+
+    @property
+    def cache_name(self) -> str:
+        return f"{self.model_name}-onnx-{self.file_name or 'model.onnx'}"
+
+    def _load(self):
+        _require("optimum.onnxruntime", "optimum[onnxruntime]", self.backend)
+        _require("onnxruntime", "optimum[onnxruntime]", self.backend)
+        from sentence_transformers import SentenceTransformer
+        model_kwargs = {"file_name": self.file_name} if self.file_name else None
+        return SentenceTransformer(self.model_name, backend="onnx", model_kwargs=model_kwargs)
+
+    def describe(self) -> Dict[str, Any]:
+        return dict(super().describe(), onnx_file=self.file_name or "model.onnx")
+
+
+class QuantizedTorchEmbedder(Embedder):
+    """PyTorch model with its Linear layers dynamically quantized to int8 (no extra dependencies)."""
+    backend = "int8"
+
+    @property
+    def cache_name(self) -> str:
+        return f"{self.model_name}-int8"
+
+    def _load(self):
+        _require("torch", "torch", self.backend)
+        import torch
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(self.model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+EMBEDDER_BACKENDS = {
+    TorchEmbedder.backend: TorchEmbedder,
+    OnnxEmbedder.backend: OnnxEmbedder,
+    QuantizedTorchEmbedder.backend: QuantizedTorchEmbedder,
+}
+
+def make_embedder(backend: str = EMBED_BACKEND, model_name: str = EMBED_MODEL_NAME) -> Embedder:
+    try:
+        cls = EMBEDDER_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; expected one of {sorted(EMBEDDER_BACKENDS)}")
+    return cls(model_name)
+
+def available_backends() -> List[str]:
+    return sorted(EMBEDDER_BACKENDS)
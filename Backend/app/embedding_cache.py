@@ -0,0 +1,176 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .config import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_LRU_SIZE
+from .core_utils import text_hash
+from .store_sync import file_lock
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store for one model, keyed by text hash.
+
+    Layout in <cache_dir>/<model_name>/:
+      vectors.f32 - raw float32 rows, read through np.memmap
+      index.txt   - "<text hash> <row>" per line (older caches: bare hash, row == line number)
+      write.lock  - flock held while appending, so several worker processes can share the cache
+    Rows are appended (vector first, then index line) and the files are never rewritten, so a
+    crash never leaves an index entry pointing at a missing vector. Each process picks up rows
+    written by the others by reading the index tail. A small in-memory LRU sits in front of the memmap.
+    """
+    def __init__(self, model_name: str, dim: int, cache_dir: str = EMBEDDING_CACHE_DIR, lru_size: int = EMBEDDING_CACHE_LRU_SIZE):
+        self.model_name = model_name
+        self.dim = int(dim)
+        self.row_bytes = self.dim * 4
+        self.dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9._-]", "_", model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.index_path = os.path.join(self.dir, "index.txt")
+        self.lock_path = os.path.join(self.dir, "write.lock")
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._rows: Dict[str, int] = {}
+        self._index_offset = 0      # bytes of index.txt consumed so far
+        self._index_lines = 0
+        self._mmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        with self._lock:
+            self._refresh_index()
+
+    def _vector_rows(self) -> int:
+        return os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+
+    def _refresh_index(self):
+        """Must hold self._lock. Reads index lines appended since the last call (by any process)."""
+        if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) <= self._index_offset:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # Counted after reading the index: vectors are written before their index lines
+        n_vectors = self._vector_rows()
+        # Only whole lines: a writer may be in the middle of appending the last one
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.decode("utf-8").splitlines():
+            parts = line.split()
+            row = int(parts[1]) if len(parts) > 1 else self._index_lines
+            self._index_lines += 1
+            if parts and row < n_vectors and parts[0] not in self._rows:
+                self._rows[parts[0]] = row
+        self._index_offset += len(data)
+
+    def _read_row(self, row: int) -> np.ndarray:
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            n_rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+        return np.array(self._mmap[row])
+
+    def _remember(self, h: str, vec: np.ndarray):
+        self._lru[h] = vec
+        self._lru.move_to_end(h)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, hashes: List[str]) -> List[Optional[np.ndarray]]:
+        out: List[Optional[np.ndarray]] = []
+        with self._lock:
+            if any(h not in self._lru and h not in self._rows for h in hashes):
+                self._refresh_index()
+            for h in hashes:
+                vec = self._lru.get(h)
+                if vec is not None:
+                    self._lru.move_to_end(h)
+                    self.memory_hits += 1
+                elif h in self._rows:
+                    vec = self._read_row(self._rows[h])
+                    self._remember(h, vec)
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+                out.append(vec)
+        return out
+
+    def put_many(self, hashes: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            for h, vec in zip(hashes, vectors):
+                self._remember(h, vec.copy())
+            with file_lock(self.lock_path):
+                # Rows other processes appended since we last looked
+                self._refresh_index()
+                fresh: Dict[str, np.ndarray] = {}
+                for h, vec in zip(hashes, vectors):
+                    if h not in self._rows and h not in fresh:
+                        fresh[h] = vec
+                if not fresh:
+                    return
+                # The next row comes from the file itself, not from this process's view of it;
+                # a torn tail left by a crashed writer is cut off first
+                start = self._vector_rows()
+                with open(self.vectors_path, "ab") as f:
+                    if f.tell() != start * self.row_bytes:
+                        f.truncate(start * self.row_bytes)
+                        f.seek(start * self.row_bytes)
+                    f.write(np.stack(list(fresh.values())).tobytes())
+                with open(self.index_path, "a", encoding="utf-8") as f:
+                    f.write("".join(f"{h} {start + i}\n" for i, h in enumerate(fresh)))
+                self._refresh_index()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "stored_vectors": len(self._rows),
+                "lru_entries": len(self._lru),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.memory_hits + self.disk_hits) / lookups) if lookups else 0.0,
+            }
+
+
+class CachedEmbedder:
+    """
+    Wraps a SentenceTransformer-like model; encode() only runs the model on texts not in the cache.
+    Exposes the same encode() call shape the engines already use.
+    """
+    def __init__(self, model, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, lru_size: int = EMBEDDING_CACHE_LRU_SIZE):
+        self.model = model
+        self.model_name = model_name
+        self.cache = EmbeddingCache(model_name, model.get_sentence_embedding_dimension(), cache_dir=cache_dir, lru_size=lru_size)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.cache.dim
+
+    def encode(self, sentences, convert_to_numpy: bool = True, normalize_embeddings: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        hashes = [text_hash(t) for t in texts]
+        vectors = self.cache.get_many(hashes)
+
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            encoded = self.model.encode([texts[i] for i in missing], convert_to_numpy=True, **kwargs)
+            encoded = np.asarray(encoded, dtype=np.float32).reshape(len(missing), -1)
+            self.cache.put_many([hashes[i] for i in missing], encoded)
+            for i, vec in zip(missing, encoded):
+                vectors[i] = vec
+
+        out = np.stack(vectors).astype(np.float32) if vectors else np.zeros((0, self.cache.dim), dtype=np.float32)
+        if normalize_embeddings and len(out):
+            out = out / np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        if single:
+            out = out[0]
+        return out if convert_to_numpy else out.tolist()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
@@ -0,0 +1,186 @@
+"""
+Shared embedding process for multi-worker deployments.
+
+    EMBEDDING_SERVER=unix:/tmp/rag-embed.sock python -m app.embedding_server
+    EMBEDDING_SERVER=unix:/tmp/rag-embed.sock uvicorn main:app --workers 4
+
+The server holds the only copy of the model (and of the on-disk embedding cache) and
+micro-batches encode requests from all API workers. Workers talk to it through RemoteEmbedder,
+which has the same encode() shape as SentenceTransformer.
+
+Wire format, both directions: 4-byte big-endian header length, JSON header, then for encode
+responses the float32 rows (shape in the header) as raw bytes.
+"""
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from typing import Dict, Any, Tuple
+
+import numpy as np
+
+from .config import EMBED_MODEL_NAME, EMBED_BACKEND, EMBEDDING_SERVER, EMBED_SERVER_MAX_BATCH, EMBED_SERVER_MAX_WAIT_MS
+
+_HEADER = struct.Struct(">I")
+
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    """"unix:/path.sock" -> (AF_UNIX, path); "tcp:host:port" or "host:port" -> (AF_INET, (host, port))."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    if address.startswith("tcp:"):
+        address = address[len("tcp:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding server connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+def send_message(sock: socket.socket, header: Dict[str, Any], payload: bytes = b""):
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data + payload)
+
+def recv_header(sock: socket.socket) -> Dict[str, Any]:
+    (length,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, length).decode("utf-8"))
+
+
+class RemoteEmbedder:
+    """SentenceTransformer-like client for the embedding server (one persistent connection per thread)."""
+    def __init__(self, address: str = EMBEDDING_SERVER, timeout: float = 120.0):
+        self.address = address
+        self.family, self.target = parse_address(address)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._dim = None
+        self.model_name = None
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.target)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _call(self, header: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        """
+        One request -> (reply header, payload bytes). Any failure drops this thread's connection, so a
+        half-read reply never desyncs the next call. A dead connection (server restarted since this
+        thread's last call) gets one retry on a fresh one; a timeout does not, since the server may
+        still be working on the request.
+        """
+        for attempt in range(2):
+            sock = self._connection()
+            try:
+                send_message(sock, header)
+                reply = recv_header(sock)
+                rows, dim = reply.get("shape") or (0, 0)
+                payload = _recv_exact(sock, rows * dim * 4)
+            except BaseException as e:
+                self._drop_connection()
+                if attempt or isinstance(e, socket.timeout) or not isinstance(e, (ConnectionError, OSError)):
+                    raise
+                continue
+            if not reply.get("ok"):
+                raise RuntimeError(f"embedding server error: {reply.get('error')}")
+            return reply, payload
+
+    def info(self) -> Dict[str, Any]:
+        reply, _ = self._call({"op": "info"})
+        self._dim = reply["dim"]
+        self.model_name = reply["model"]
+        return reply
+
+    def stats(self) -> Dict[str, Any]:
+        reply, _ = self._call({"op": "stats"})
+        return reply["stats"]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            self.info()
+        return self._dim
+
+    def encode(self, sentences, convert_to_numpy: bool = True, normalize_embeddings: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        reply, payload = self._call({"op": "encode", "texts": texts})
+        rows, dim = reply["shape"]
+        out = np.frombuffer(payload, dtype=np.float32).reshape(rows, dim).copy()
+        if normalize_embeddings and len(out):
+            out = out / np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        if single:
+            out = out[0]
+        return out if convert_to_numpy else out.tolist()
+
+
+def serve(address: str = EMBEDDING_SERVER, max_batch: int = EMBED_SERVER_MAX_BATCH, max_wait_ms: float = EMBED_SERVER_MAX_WAIT_MS):
+    from .embedders import make_embedder
+    from .embedding_cache import CachedEmbedder
+    from .embed_batcher import MicroBatcher
+
+    if not address:
+        raise SystemExit("Set EMBEDDING_SERVER (e.g. unix:/tmp/rag-embed.sock or tcp:127.0.0.1:8765)")
+
+    model = make_embedder(EMBED_BACKEND, EMBED_MODEL_NAME)
+    embedder = CachedEmbedder(model, model_name=model.cache_name)
+    batcher = MicroBatcher(lambda texts: embedder.encode(texts, convert_to_numpy=True), max_batch=max_batch, max_wait_ms=max_wait_ms)
+    dim = embedder.get_sentence_embedding_dimension()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            sock = self.request
+            while True:
+                try:
+                    request = recv_header(sock)
+                except (ConnectionError, OSError):
+                    return
+                try:
+                    op = request.get("op")
+                    if op == "encode":
+                        vectors = batcher.encode(request.get("texts") or [])
+                        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, dim)
+                        send_message(sock, {"ok": True, "shape": list(vectors.shape)}, vectors.tobytes())
+                    elif op == "info":
+                        send_message(sock, {"ok": True, "model": model.cache_name, "backend": model.backend, "dim": dim})
+                    elif op == "stats":
+                        send_message(sock, {"ok": True, "stats": {"batcher": batcher.stats(), "cache": embedder.stats()}})
+                    else:
+                        send_message(sock, {"ok": False, "error": f"unknown op {op!r}"})
+                except Exception as e:
+                    send_message(sock, {"ok": False, "error": str(e)})
+
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)
+        server = socketserver.ThreadingUnixStreamServer(target, Handler)
+    else:
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        server = socketserver.ThreadingTCPServer(target, Handler)
+    server.daemon_threads = True
+    print(f"Embedding server ({EMBED_MODEL_NAME}, {model.backend}, dim {dim}) listening on {address}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
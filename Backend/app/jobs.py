@@ -0,0 +1,83 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional
+
+from .config import INGEST_WORKERS
+
+
+class JobManager:
+    """
+    Runs long tasks (ingestion) on a background worker pool and keeps their status for polling.
+    The task function receives a progress(stage, done, total, **counts) callback as its first argument;
+    counts (e.g. chunks=120) are merged into the job's running "counts".
+    """
+    def __init__(self, max_workers: int = 1, keep_finished: int = 100):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.keep_finished = keep_finished
+
+    def submit(self, fn: Callable, *args, on_finish: Optional[Callable[[], None]] = None, **kwargs) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "stage": None,
+                "done": 0,
+                "total": 0,
+                "counts": {},
+                "message": None,
+                "error": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self._prune()
+
+        def _progress(stage: str, done: int = 0, total: int = 0, **counts):
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job.update(stage=stage, done=done, total=total, counts=dict(job["counts"], **counts))
+
+        def _run():
+            self._update(job_id, status="running", started_at=time.time())
+            try:
+                message = fn(_progress, *args, **kwargs)
+                failed = isinstance(message, str) and message.startswith("Error")
+                self._update(job_id, status="error" if failed else "done", message=message,
+                             error=message if failed else None, finished_at=time.time())
+            except Exception as e:
+                traceback.print_exc()
+                self._update(job_id, status="error", error=str(e), finished_at=time.time())
+            finally:
+                if on_finish:
+                    on_finish()
+
+        self._pool.submit(_run)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j["status"] in ("done", "error")]
+        if len(finished) <= self.keep_finished:
+            return
+        for job in sorted(finished, key=lambda j: j["created_at"])[:len(finished) - self.keep_finished]:
+            del self._jobs[job["id"]]
+
+
+# Jobs for the same namespace are serialized by the namespace's ingest lock
+job_manager = JobManager(max_workers=INGEST_WORKERS)
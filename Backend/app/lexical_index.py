@@ -0,0 +1,151 @@
+import os
+import re
+from collections import Counter
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+import numpy as np
+
+from .config import LEXICAL_INDEX_DIR
+
+# Keeps course codes / formula names together: "cs-101", "h2o", "tf.idf", "o(n)" -> "o", "n"
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall((text or "").lower())
+
+
+class BM25Index:
+    """
+    Compact in-process inverted index over chunk texts.
+
+    Postings are stored CSR-style: the postings of term t are
+    post_docs[term_offsets[t]:term_offsets[t + 1]] (chunk row numbers) with matching post_tfs.
+    The whole index is a handful of NumPy arrays, persisted as a single .npz.
+    """
+    def __init__(self, ids: List[str], vocab: List[str], term_offsets: np.ndarray, post_docs: np.ndarray, post_tfs: np.ndarray, doc_lens: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        self.ids = list(ids)
+        self.vocab = {t: i for i, t in enumerate(vocab)}
+        self._vocab_list = list(vocab)
+        self.term_offsets = term_offsets
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(self.ids)
+        self.avg_len = float(doc_lens.mean()) if self.n_docs else 0.0
+        df = np.diff(term_offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self._row_of = {cid: i for i, cid in enumerate(self.ids)}
+
+    @classmethod
+    def build(cls, docs: Iterable[Tuple[str, str]]) -> "BM25Index":
+        """docs: iterable of (chunk_id, text)."""
+        ids: List[str] = []
+        doc_lens: List[int] = []
+        vocab: Dict[str, int] = {}
+        postings: List[List[Tuple[int, int]]] = []
+        for row, (cid, text) in enumerate(docs):
+            tokens = tokenize(text)
+            ids.append(cid)
+            doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                tid = vocab.get(term)
+                if tid is None:
+                    tid = vocab[term] = len(postings)
+                    postings.append([])
+                postings[tid].append((row, tf))
+
+        term_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(p) for p in postings]) if postings else []
+        post_docs = np.fromiter((row for p in postings for row, _ in p), dtype=np.int32, count=int(term_offsets[-1]))
+        post_tfs = np.fromiter((tf for p in postings for _, tf in p), dtype=np.int32, count=int(term_offsets[-1]))
+        return cls(ids, list(vocab), term_offsets, post_docs, post_tfs, np.asarray(doc_lens, dtype=np.float32))
+
+    @classmethod
+    def build_from_collection(cls, collection, page_size: int = 500) -> "BM25Index":
+        """Builds the index by paging through a Chroma collection (documents only, no embeddings)."""
+        def _docs():
+            offset = 0
+            while True:
+                res = collection.get(include=["documents"], limit=page_size, offset=offset)
+                ids = res.get("ids") or []
+                if not ids:
+                    return
+                yield from zip(ids, res.get("documents") or [])
+                offset += len(ids)
+        return cls.build(_docs())
+
+    def search(self, query: str, k: int = 8, allowed_ids: Optional[set] = None) -> List[Dict[str, Any]]:
+        """
+        Top-k chunks by BM25. Each hit also reports `coverage`: the idf-weighted share of query
+        terms it contains, over the terms that occur in the corpus at all (1.0 = all of them present),
+        a corpus-independent strength signal.
+        """
+        terms = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not terms or not self.n_docs:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        matched = np.zeros(self.n_docs, dtype=np.float32)
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_lens / max(self.avg_len, 1e-9))
+        for tid in terms:
+            lo, hi = self.term_offsets[tid], self.term_offsets[tid + 1]
+            docs = self.post_docs[lo:hi]
+            tfs = self.post_tfs[lo:hi].astype(np.float32)
+            scores[docs] += self.idf[tid] * tfs * (self.k1 + 1.0) / (tfs + norm[docs])
+            matched[docs] += self.idf[tid]
+        # Terms unknown to the corpus are ignored: they match nothing, and counting them (question words
+        # like "what" / "explain" that never appear in the notes) would push every coverage down
+        total_idf = float(self.idf[terms].sum())
+
+        if allowed_ids is not None:
+            mask = np.zeros(self.n_docs, dtype=bool)
+            rows = [self._row_of[cid] for cid in allowed_ids if cid in self._row_of]
+            mask[rows] = True
+            scores[~mask] = 0.0
+
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return []
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [
+            {"id": self.ids[i], "bm25_score": float(scores[i]), "coverage": float(matched[i] / total_idf) if total_idf else 0.0}
+            for i in candidates
+        ]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=np.array(self.ids, dtype=str),
+            vocab=np.array(self._vocab_list, dtype=str),
+            term_offsets=self.term_offsets,
+            post_docs=self.post_docs,
+            post_tfs=self.post_tfs,
+            doc_lens=self.doc_lens,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["ids"].tolist(), data["vocab"].tolist(), data["term_offsets"],
+                data["post_docs"], data["post_tfs"], data["doc_lens"]
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chunks": self.n_docs,
+            "terms": len(self.vocab),
+            "postings": int(self.term_offsets[-1]),
+            "bytes": int(self.post_docs.nbytes + self.post_tfs.nbytes + self.term_offsets.nbytes + self.doc_lens.nbytes),
+        }
+
+
+def lexical_index_path(collection_name: str) -> str:
+    return os.path.join(LEXICAL_INDEX_DIR, f"{collection_name}.npz")
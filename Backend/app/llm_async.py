@@ -0,0 +1,93 @@
+import asyncio
+import traceback
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from .rate_limiter import provider_rate_limiter, estimate_tokens
+from .config import require_api_key, LLM_BASE_URL, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE, LLM_TIMEOUT
+from .core_utils import (
+    _extract_text_from_response,
+    classify_llm_error,
+    is_rate_limited,
+    llm_retry_delay,
+    observe_prompt_usage,
+    model_catalog_cache,
+    pick_fallback_model,
+)
+
+# httpx connection pools belong to the event loop that opened them, so there is one client per loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+def get_async_llm_client():
+    """Pooled AsyncOpenAI client for the running event loop (keep-alive connections are reused across calls)."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        )
+        # Retries are handled below (Retry-After + jittered backoff), not by the SDK
+        client = AsyncOpenAI(api_key=require_api_key(), base_url=LLM_BASE_URL, http_client=http_client, max_retries=0)
+        _clients[loop] = client
+    return client
+
+async def close_async_llm_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+async def acall_llm_summarize(prompt: str, max_tokens: int = 1024, model: Optional[str] = None, temperature: float = 0.0, stop: Optional[List[str]] = None, retry: int = 1, backoff_base: float = 1.0) -> Dict[str, Any]:
+    """Async call_llm_summarize: same result shape, but waits (network and backoff) without holding a thread."""
+    # The catalog is usually cached; a refresh is a blocking round-trip, so keep it off the loop
+    chosen = await asyncio.to_thread(pick_fallback_model, model)
+    last_tb = None
+    for attempt in range(0, retry + 1):
+        await provider_rate_limiter.acquire_async(estimate_tokens(prompt) + max_tokens)
+        try:
+            call_kwargs: Dict[str, Any] = {"model": chosen, "input": prompt, "max_output_tokens": max_tokens, "temperature": temperature}
+            if stop: call_kwargs["stop"] = stop
+            resp = await get_async_llm_client().responses.create(**call_kwargs)
+            observe_prompt_usage(prompt, resp)
+            text = _extract_text_from_response(resp)
+            return {"ok": True, "text": text, "resp": resp}
+        except Exception as e:
+            last_tb = traceback.format_exc()
+            kind = classify_llm_error(e)
+            if kind is None:
+                return {"ok": False, "text": None, "resp": last_tb}
+            if kind == "model":
+                model_catalog_cache.invalidate()
+                chosen = await asyncio.to_thread(pick_fallback_model, None)
+            if attempt < retry:
+                delay = llm_retry_delay(e, attempt, backoff_base)
+                if is_rate_limited(e):
+                    provider_rate_limiter.backoff(delay)
+                else:
+                    await asyncio.sleep(delay)
+    return {"ok": False, "text": None, "resp": last_tb}
+
+async def acall_llm_text_only(prompt: str, max_tokens: int, temperature: float) -> str:
+    result = await acall_llm_summarize(prompt, max_tokens=max_tokens, temperature=temperature)
+    if result.get("ok") and result.get("text"):
+        return result["text"]
+    return ""
+
+async def acall_llm_answer(prompt_text: str, max_tokens: int = 512, temperature: float = 0.0):
+    out = await acall_llm_summarize(prompt_text, max_tokens=max_tokens, temperature=temperature)
+    if isinstance(out, dict) and "text" in out:
+        return out["text"]
+    return str(out)
+
+async def gather_limited(fn: Callable[[Any], Awaitable[Any]], items: List[Any], max_concurrency: int) -> List[Any]:
+    """Awaits fn over items with at most max_concurrency in flight; results keep the input order."""
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _one(item):
+        async with semaphore:
+            return await fn(item)
+
+    return list(await asyncio.gather(*(_one(item) for item in items)))
@@ -1,8 +1,10 @@
+import asyncio
 import json
 import re
-from .core_utils import call_llm_answer, get_all_chunks_from_collection
+from .core_utils import get_all_chunks_from_collection
+from .llm_async import acall_llm_answer
 
-def generate_mcqs_from_context(context: str, n_questions: int = 5, call_llm_fn=call_llm_answer, temperature: float = 0.0, max_tokens: int = 2000):
+def build_mcq_prompt(context: str, n_questions: int = 5) -> str:
     # We ask for a "clear" explanation that mentions the specific fact.
     prompt = f"""
 You are a strict exam setter.
@@ -21,8 +23,9 @@ CONTEXT:
 
 JSON OUTPUT:
 """
-    raw = call_llm_fn(prompt, max_tokens=max_tokens, temperature=temperature)
+    return prompt
 
+def parse_mcqs(raw: str):
     # Robust JSON Parsing Logic (re-using the fix from before)
     try:
         match = re.search(r'\[.*\]', raw, flags=re.S)
@@ -52,20 +55,20 @@ JSON OUTPUT:
         print("❌ JSON parsing error:", e)
         return [{"raw": raw}]
 
-def quiz_from_full_summary(collection, embed_model, call_llm_fn=call_llm_answer, n_questions=10, summarizer_fn=None):
+async def agenerate_mcqs_from_context(context: str, n_questions: int = 5, acall_llm_fn=acall_llm_answer, temperature: float = 0.0, max_tokens: int = 2000):
+    raw = await acall_llm_fn(build_mcq_prompt(context, n_questions), max_tokens=max_tokens, temperature=temperature)
+    return parse_mcqs(raw)
+
+def _fallback_quiz_context(collection) -> str:
+    all_chunks = get_all_chunks_from_collection(collection)
+    return "\n".join(c["text"][:1500] for c in all_chunks)[:6000]
+
+async def aquiz_from_full_summary(collection, acall_llm_fn=acall_llm_answer, n_questions=10, summarizer_fn=None):
+    """MCQs from the corpus summary; summarizer_fn, if given, is awaited (e.g. the cached map-reduce)."""
     if summarizer_fn:
-        summary_result = summarizer_fn(collection, call_llm_fn, show_progress=False)
+        summary_result = await summarizer_fn(collection, show_progress=False)
         final_summary = summary_result.get("final_summary", "")
     else:
-        try:
-            all_chunks = get_all_chunks_from_collection(collection)
-            final_summary = "\n".join(c["text"][:1500] for c in all_chunks)[:6000]
-        except NameError:
-             final_summary = "Error: Could not retrieve text for quiz."
+        final_summary = await asyncio.to_thread(_fallback_quiz_context, collection)
 
-    mcqs = generate_mcqs_from_context(
-        final_summary,
-        n_questions=n_questions,
-        call_llm_fn=call_llm_fn
-    )
-    return mcqs
\ No newline at end of file
+    return await agenerate_mcqs_from_context(final_summary, n_questions=n_questions, acall_llm_fn=acall_llm_fn)
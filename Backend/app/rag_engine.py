@@ -1,141 +1,653 @@
+import asyncio
 import os
-import chromadb
-from sentence_transformers import SentenceTransformer
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from itertools import groupby
+from typing import Optional
 
 # Import Logic Modules
 from .core_utils import (
-    extract_text_universal,  # <--- NEW IMPORT
-    build_combined_document, 
-    simple_chunk_text, 
-    upsert_chunks_to_chroma,
+    iter_extract_parallel,
+    iter_document_chunks,
+    file_content_hash,
+    get_doc_hash_index,
+    upsert_chunk_stream,
+    copy_chunks,
     save_quiz_to_disk,      # <--- New Import
     list_saved_quizzes,     # <--- New Import
     load_quiz_from_disk,
-    call_llm_text_only,
     call_llm_answer,
+    collection_fingerprint,
     save_summary_to_disk, list_saved_summaries, load_summary_from_disk
 )
-from .summary_engine import summarize_entire_collection_map_reduce
-from .chat_engine import answer_question_rag
-from .quiz_engine import quiz_from_full_summary
+from .summary_engine import asummarize_entire_collection_map_reduce
+from .chat_engine import aanswer_question_rag, stream_answer_question_rag
+from .quiz_engine import aquiz_from_full_summary
+from .llm_async import acall_llm_text_only, acall_llm_answer
+from .summary_cache import SummaryCache
+from .answer_cache import AnswerCache
+from .embedding_cache import CachedEmbedder
+from .lexical_index import BM25Index, lexical_index_path
+from .vector_index import MatrixIndex, vector_index_path, vector_index_files
+from .store_sync import interprocess_lock, bump_generation, read_generation
+from .config import EMBED_MODEL_NAME, EMBED_BACKEND, EMBEDDING_SERVER, QUERY_BATCHING, QUERY_BATCH_MAX, QUERY_BATCH_MAX_WAIT_MS, CHROMA_HOST, CHROMA_PORT, API_KEY, llm_client_loaded, NAMESPACE_MAX_OPEN, NAMESPACE_IDLE_TTL, NAMESPACE_DISK_TTL, VECTOR_BACKEND, VECTOR_INDEX_MMAP, VECTOR_INDEX_DTYPE, ANSWER_CACHE_SEMANTIC
+
+DEFAULT_NAMESPACE = "default"
+COLLECTION_NAME = "pdf_store"          # collection of the default namespace
+NAMESPACE_PREFIX = "ns_"
+
+def namespace_collection_name(namespace: str) -> str:
+    """Chroma collection name for a session/workspace id (ids are hashed to a valid, fixed-length name)."""
+    if namespace == DEFAULT_NAMESPACE:
+        return COLLECTION_NAME
+    return NAMESPACE_PREFIX + hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:24]
+
+def versioned_collection_name(base: str, generation: int) -> str:
+    """Physical collection holding a given generation of a corpus (generation 0 = the original, unversioned name)."""
+    return base if generation <= 0 else f"{base}_g{generation}"
+
+def collection_generation(base: str, name: str) -> Optional[int]:
+    """Generation of a physical collection of corpus `base`, or None if it belongs to another corpus."""
+    if name == base:
+        return 0
+    match = re.fullmatch(re.escape(base) + r"_g(\d+)", name)
+    return int(match.group(1)) if match else None
+
+def base_collection_name(name: str) -> str:
+    return re.sub(r"_g\d+$", "", name)
+
+
+class Namespace:
+    """
+    One student's / workspace's corpus: its own collection, summary cache and ingestion lock.
+    The collection handle is opened lazily on first use.
+
+    collection_name is the corpus' stable name (lock, generation marker). Each ingestion writes a
+    new physical collection <collection_name>_g<N>; the generation file in STORE_SYNC_DIR says
+    which one is live, so switching corpora is a single atomic file rename.
+    """
+    def __init__(self, name: str, client):
+        self.name = name
+        self.collection_name = namespace_collection_name(name)
+        self._client = client
+        self._collection = None
+        self._lexical_index = None
+        self._vector_index = None
+        self._open_lock = threading.Lock()
+        # Serializes writers; readers never take it and just use whatever self.collection points to
+        self.ingest_lock = threading.Lock()
+        self.summary_cache = SummaryCache()
+        self.answer_cache = AnswerCache()
+        self._fingerprint = None
+        self._generation = read_generation(self.collection_name)
+        self.last_used = time.time()
+
+    def _sync_generation(self):
+        # Another worker process swapped in a new corpus: drop handles and caches for the old one
+        generation = read_generation(self.collection_name)
+        if generation != self._generation:
+            with self._open_lock:
+                if generation != self._generation:
+                    self._collection = None
+                    self._lexical_index = None
+                    self._vector_index = None
+                    self.invalidate_corpus_caches()
+                    self._generation = generation
+
+    @property
+    def active_collection_name(self) -> str:
+        return versioned_collection_name(self.collection_name, self._generation)
+
+    @property
+    def collection(self):
+        self._sync_generation()
+        if self._collection is None:
+            with self._open_lock:
+                if self._collection is None:
+                    self._collection = self._client.get_or_create_collection(name=self.active_collection_name)
+        return self._collection
+
+    @collection.setter
+    def collection(self, value):
+        self._collection = value
+
+    @property
+    def lexical_index(self):
+        """BM25 index for the collection: loaded from disk, or rebuilt if missing/out of date."""
+        if self._lexical_index is None:
+            collection = self.collection
+            with self._open_lock:
+                if self._lexical_index is None:
+                    path = lexical_index_path(self.active_collection_name)
+                    index = None
+                    try:
+                        if os.path.exists(path):
+                            index = BM25Index.load(path)
+                            if index.n_docs != collection.count():
+                                index = None
+                    except Exception as e:
+                        print(f"Warning: could not load lexical index {path}: {e}")
+                        index = None
+                    if index is None:
+                        index = BM25Index.build_from_collection(collection)
+                        index.save(path)
+                    self._lexical_index = index
+        return self._lexical_index
+
+    @lexical_index.setter
+    def lexical_index(self, value):
+        self._lexical_index = value
+
+    @property
+    def vector_index(self):
+        """Matrix of the stored embeddings for local search: memory-mapped from disk, or loaded from the collection."""
+        if self._vector_index is None:
+            collection = self.collection
+            with self._open_lock:
+                if self._vector_index is None:
+                    path = vector_index_path(self.active_collection_name)
+                    index = None
+                    if PERSIST_VECTOR_INDEX:
+                        try:
+                            if os.path.exists(path + ".npy"):
+                                index = MatrixIndex.load(path, mmap=True)
+                                if len(index.ids) != collection.count():
+                                    index = None
+                        except Exception as e:
+                            print(f"Warning: could not load vector index {path}: {e}")
+                            index = None
+                    if index is None:
+                        index = MatrixIndex.from_collection(collection)
+                        index.measure_recall()
+                        if PERSIST_VECTOR_INDEX:
+                            index.save(path)
+                            index = MatrixIndex.load(path, mmap=True)
+                    self._vector_index = index
+        return self._vector_index
+
+    @vector_index.setter
+    def vector_index(self, value):
+        self._vector_index = value
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def corpus_fingerprint(self) -> str:
+        """Fingerprint of the current collection contents (computed once per corpus)."""
+        if self._fingerprint is None:
+            self._fingerprint = collection_fingerprint(self.collection)
+        return self._fingerprint
+
+    def invalidate_corpus_caches(self):
+        self._fingerprint = None
+        self.summary_cache.clear()
+        self.answer_cache.clear()
+
+    async def asummarize_cached(self, collection, acall_llm_fn, batch_size: int = 6, **kwargs):
+        """asummarize_entire_collection_map_reduce that reuses artifacts for an unchanged corpus."""
+        key = (await asyncio.to_thread(self.corpus_fingerprint), batch_size)
+        return await self.summary_cache.aget_or_compute(
+            key,
+            lambda: asummarize_entire_collection_map_reduce(collection, acall_llm_fn, batch_size=batch_size, **kwargs)
+        )
+
+    def persist_last_used(self):
+        # Stored on the collection so idle namespaces can be found (and deleted) after restarts
+        try:
+            if self._collection is not None:
+                self._collection.modify(metadata={"last_used": self.last_used, "namespace": self.name[:256]})
+        except Exception as e:
+            print(f"Warning: could not persist last_used for namespace {self.name}: {e}")
+
+
+PERSIST_DIR = "./chroma_db_storage"
+# A compact index only saves RAM when its float32 rows are memory-mapped from disk
+PERSIST_VECTOR_INDEX = VECTOR_INDEX_MMAP or VECTOR_INDEX_DTYPE != "float32"
+
 
 class RAGService:
+    """
+    Construction is cheap: the embedder and the Chroma client are created on first use
+    (or by warm_up() in the background at startup), so the server can accept requests immediately.
+    """
     def __init__(self):
         print("Initializing RAG Service...")
-        self.embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-        
-        persist_dir = "./chroma_db_storage"
-        os.makedirs(persist_dir, exist_ok=True)
-        
-        self.client = chromadb.PersistentClient(path=persist_dir)
-        
+        self._embed_model = None
+        self._query_embedder = None
+        self._client = None
+        self._embed_lock = threading.Lock()
+        self._client_lock = threading.Lock()
+        self.started_at = time.time()
+        self.warmup = {"status": "not_started", "seconds": None, "error": None}
+
+        self._namespaces: "OrderedDict[str, Namespace]" = OrderedDict()
+        self._namespaces_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    @property
+    def embed_model(self):
+        # All encoding (ingestion + queries) goes through the persistent embedding cache; with
+        # EMBEDDING_SERVER set, the model and that cache live in the shared embedding process
+        if self._embed_model is None:
+            with self._embed_lock:
+                if self._embed_model is None and EMBEDDING_SERVER:
+                    from .embedding_server import RemoteEmbedder
+                    self._embed_model = RemoteEmbedder(EMBEDDING_SERVER)
+                    print(f"Using embedding server at {EMBEDDING_SERVER}")
+                if self._embed_model is None:
+                    started = time.perf_counter()
+                    from .embedders import make_embedder
+                    embedder = make_embedder(EMBED_BACKEND, EMBED_MODEL_NAME)
+                    self._embed_model = CachedEmbedder(embedder, model_name=embedder.cache_name)
+                    print(f"Embedding model loaded ({embedder.backend}) in {time.perf_counter() - started:.1f}s")
+        return self._embed_model
+
+    @property
+    def query_embedder(self):
+        """Embedder for chat-time questions: micro-batched across concurrent requests when QUERY_BATCHING is on."""
+        if self._query_embedder is None:
+            embed_model = self.embed_model
+            with self._embed_lock:
+                if self._query_embedder is None:
+                    if QUERY_BATCHING:
+                        from .embed_batcher import BatchedEncoder
+                        self._query_embedder = BatchedEncoder(embed_model, max_batch=QUERY_BATCH_MAX, max_wait_ms=QUERY_BATCH_MAX_WAIT_MS)
+                    else:
+                        self._query_embedder = embed_model
+        return self._query_embedder
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import chromadb
+                    if CHROMA_HOST:
+                        # Shared Chroma server: it serializes writes from all API workers
+                        self._client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+                    else:
+                        os.makedirs(PERSIST_DIR, exist_ok=True)
+                        self._client = chromadb.PersistentClient(path=PERSIST_DIR)
+        return self._client
+
+    def warm_up(self):
+        """Loads everything the first chat request needs (model, store, default namespace, one encode)."""
+        self.warmup.update(status="running")
+        started = time.perf_counter()
         try:
-            self.collection = self.client.get_collection(name="pdf_store")
-        except:
-            self.collection = self.client.create_collection(name="pdf_store")
-        
-    def process_files(self, file_paths: list):
-        """
-        1. RESET DB
-        2. Iterate through all files -> Extract Text
-        3. Merge text into one document structure
-        4. Chunk & Upsert
-        """
-        print(f"Processing {len(file_paths)} files...")
+            self.query_embedder.encode(["warm-up"], convert_to_numpy=True)
+            ns = self.namespace(DEFAULT_NAMESPACE)
+            if ns.collection.count():
+                ns.lexical_index  # loads (or rebuilds) the BM25 index
+            self.warmup.update(status="done", seconds=round(time.perf_counter() - started, 2))
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+            self.warmup.update(status="error", error=str(e), seconds=round(time.perf_counter() - started, 2))
+
+    def status(self):
+        """What is loaded so far (for /health and /ready)."""
+        return {
+            "embedder_loaded": self._embed_model is not None,
+            "embedder_backend": "remote" if EMBEDDING_SERVER else EMBED_BACKEND,
+            "vector_store_open": self._client is not None,
+            "llm_client_loaded": llm_client_loaded(),
+            "llm_configured": bool(API_KEY),
+            "open_namespaces": len(self._namespaces),
+            "warmup": dict(self.warmup),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+        }
+
+    def is_ready(self) -> bool:
+        return self._embed_model is not None and self._client is not None and bool(API_KEY)
 
-        # 1. Reset Database
+    def embedding_stats(self):
+        if self._embed_model is None:
+            return None
         try:
-            self.client.delete_collection(name="pdf_store")
-        except Exception:
-            pass
-        self.collection = self.client.create_collection(name="pdf_store")
+            return self._embed_model.stats()
+        except Exception as e:
+            return {"error": str(e)}
+
+    def query_batching_stats(self):
+        batcher = getattr(self._query_embedder, "batcher", None)
+        return batcher.stats() if batcher is not None else None
+
+    def namespace(self, session_id: str = DEFAULT_NAMESPACE) -> Namespace:
+        """Returns the (lazily opened) namespace for a session, marking it as recently used."""
+        session_id = session_id or DEFAULT_NAMESPACE
+        client = self.client
+        with self._namespaces_lock:
+            ns = self._namespaces.get(session_id)
+            if ns is None:
+                ns = Namespace(session_id, client)
+                self._namespaces[session_id] = ns
+            self._namespaces.move_to_end(session_id)
+            ns.touch()
+        self.evict_idle_namespaces()
+        return ns
+
+    def evict_idle_namespaces(self, force: bool = False):
+        """
+        Memory: closes handles idle longer than NAMESPACE_IDLE_TTL or beyond NAMESPACE_MAX_OPEN (LRU).
+        Disk: deletes namespace collections that have not been used for NAMESPACE_DISK_TTL.
+        Runs at most once a minute unless forced.
+        """
+        now = time.time()
+        if not force and now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
 
-        all_pages = []
+        closed = []
+        with self._namespaces_lock:
+            for name, ns in list(self._namespaces.items()):
+                too_many = len(self._namespaces) > NAMESPACE_MAX_OPEN
+                if name != DEFAULT_NAMESPACE and (too_many or now - ns.last_used > NAMESPACE_IDLE_TTL) and not ns.ingest_lock.locked():
+                    closed.append(self._namespaces.pop(name))
+            open_names = {ns.collection_name for ns in self._namespaces.values()}
+        for ns in closed:
+            ns.persist_last_used()
 
-        # 2. Extract Text from Each File
-        for path in file_paths:
+        try:
+            collections = self.client.list_collections()
+        except Exception as e:
+            print("Warning: list_collections() failed:", e)
+            return
+        for col in collections:
+            name = getattr(col, "name", col)
+            if not str(name).startswith(NAMESPACE_PREFIX) or base_collection_name(name) in open_names:
+                continue
             try:
-                # Extract raw pages
-                file_pages = extract_text_universal(path)
-                
-                # Add Filename to Page Number (e.g., "lecture1.pdf - Page 1")
-                # This ensures the AI knows which document the info came from.
-                filename = os.path.basename(path).replace("temp_", "")
-                for p in file_pages:
-                    p["page_number"] = f"{filename} (Page {p['page_number']})"
-                
-                all_pages.extend(file_pages)
-                
-            except ValueError as e:
-                print(f"Skipping file {path}: {e}")
+                meta = (self.client.get_collection(name=name).metadata or {})
+            except Exception:
                 continue
+            if now - float(meta.get("last_used", now)) > NAMESPACE_DISK_TTL:
+                print(f"Deleting idle namespace collection {name}")
+                try:
+                    self._delete_collection_files(name)
+                except Exception as e:
+                    print(f"Warning: could not delete {name}: {e}")
 
-        if not all_pages:
-            return "Error: No text could be extracted from any of the uploaded files."
+    def _delete_collection_files(self, name: str):
+        """Drops a physical collection and the index files saved for it."""
+        self.client.delete_collection(name=name)
+        for path in [lexical_index_path(name)] + vector_index_files(name):
+            if os.path.exists(path):
+                os.remove(path)
 
-        # 3. Merge & Chunk
-        doc = build_combined_document(all_pages)
-        chunks = simple_chunk_text(doc["combined_text"])
-        
-        print(f"Total merged chunks: {len(chunks)}")
-        
-        # 4. Upsert to Chroma
-        upsert_chunks_to_chroma(chunks, self.embed_model, self.collection)
+    def _drop_old_generations(self, base: str, keep_from: int):
+        """
+        Deletes the physical collections of `base` older than generation keep_from (and the
+        pre-versioning "<base>_staging"). The generation just replaced is kept until the next
+        ingestion, so requests still holding its handle finish normally.
+        """
+        try:
+            names = [getattr(col, "name", col) for col in self.client.list_collections()]
+        except Exception as e:
+            print("Warning: list_collections() failed:", e)
+            return
+        for name in names:
+            generation = collection_generation(base, name)
+            if name == f"{base}_staging" or (generation is not None and generation < keep_from):
+                try:
+                    self._delete_collection_files(name)
+                except Exception as e:
+                    print(f"Warning: could not delete old corpus {name}: {e}")
+
+    def namespace_stats(self):
+        with self._namespaces_lock:
+            return {
+                "open": len(self._namespaces),
+                "namespaces": {
+                    name: {
+                        "last_used": ns.last_used,
+                        "summary_cache": ns.summary_cache.stats(),
+                        "answer_cache": ns.answer_cache.stats(),
+                        "lexical_index": ns._lexical_index.stats() if ns._lexical_index is not None else None,
+                        "vector_index": ns._vector_index.stats() if ns._vector_index is not None else None,
+                    }
+                    for name, ns in self._namespaces.items()
+                },
+            }
+
+    @property
+    def collection(self):
+        """Collection of the default namespace (kept for single-user callers)."""
+        return self.namespace(DEFAULT_NAMESPACE).collection
         
-        return f"Successfully processed {len(file_paths)} files. Merged into {len(chunks)} chunks."
+    def process_files(self, file_paths: list, mode: str = "incremental", progress_fn=None, session_id: str = DEFAULT_NAMESPACE):
+        """
+        Builds the new corpus in the next generation's collection and swaps it in at the end, so chat
+        keeps serving the previous corpus until ingestion has fully finished. The live collection is
+        never modified or deleted before the swap, so a crash at any point leaves it intact.
+
+        mode="incremental": the uploaded files become the corpus. Documents are identified by
+            content hash; unchanged documents are copied over without re-extraction, known chunk
+            texts keep their stored embeddings, and documents not in the upload are dropped.
+        mode="replace": rebuild everything from scratch.
+        progress_fn(stage, done, total, **counts) reports copy/extract/chunk/embed/upsert/index progress.
+        """
+        if mode not in ("incremental", "replace"):
+            raise ValueError(f"Unknown ingestion mode: {mode}")
+        progress = progress_fn or (lambda stage, done=0, total=0, **counts: None)
+        ns = self.namespace(session_id)
+        print(f"Processing {len(file_paths)} files ({mode}, namespace {ns.name})...")
+
+        # ingest_lock serializes threads of this worker, interprocess_lock the other API workers
+        with ns.ingest_lock, interprocess_lock(ns.collection_name):
+            live = ns.collection
+            generation = read_generation(ns.collection_name)
+            existing = get_doc_hash_index(live) if mode == "incremental" else {}
+            desired_hashes = set()
+            kept_docs = []
+
+            # 1. Hash every file; only documents not already stored need extraction
+            to_extract = []
+            seen_hashes = set()
+            for doc_index, path in enumerate(file_paths):
+                doc_hash = file_content_hash(path)
+                if doc_hash in seen_hashes:
+                    print(f"Skipping duplicate file {path}")
+                    continue
+                seen_hashes.add(doc_hash)
+                if doc_hash in existing:
+                    desired_hashes.add(doc_hash)
+                    kept_docs.append((doc_hash, doc_index))
+                else:
+                    to_extract.append((doc_hash, doc_index, path))
+
+            # 2. Build the next generation's collection (unchanged documents are copied, not re-encoded).
+            #    A leftover of that name can only come from a crashed ingestion and is never live
+            staging_name = versioned_collection_name(ns.collection_name, generation + 1)
+            try:
+                self.client.delete_collection(name=staging_name)
+            except Exception:
+                pass
+            staging = self.client.create_collection(name=staging_name)
+
+            kept_total = sum(len(existing[doc_hash]) for doc_hash, _ in kept_docs)
+            copied = 0
+            for doc_hash, doc_index in kept_docs:
+                copied += copy_chunks(live, staging, existing[doc_hash], {"doc_index": doc_index})
+                progress("copy", copied, kept_total, copied=copied)
+
+            # 3. Stream new documents: extract (process pool) -> clean -> chunk -> embed/upsert in batches
+            meta_by_path = {path: (doc_hash, doc_index) for doc_hash, doc_index, path in to_extract}
+            failed_hashes = set()
+
+            def _source_name(path):
+                return os.path.basename(path).replace("temp_", "")
+
+            def _labelled_pages(path, page_lists):
+                # Label pages with the filename (e.g., "lecture1.pdf (Page 1)") for the in-text page marker.
+                # This ensures the AI knows which document the info came from; page_number stays numeric.
+                filename = _source_name(path)
+                for _, pages in page_lists:
+                    if isinstance(pages, Exception):
+                        print(f"Skipping file {path}: {pages}")
+                        failed_hashes.add(meta_by_path[path][0])
+                        return
+                    for p in pages:
+                        p["label"] = f"{filename} (Page {p['page_number']})"
+                        yield p
+
+            def _new_chunks():
+                progress("extract", 0, len(to_extract))
+                extracted = iter_extract_parallel([path for _, _, path in to_extract], progress_fn=progress)
+                n_chunks = 0
+                for docs_chunked, (path, page_lists) in enumerate(groupby(extracted, key=lambda item: item[0]), 1):
+                    doc_hash, doc_index = meta_by_path[path]
+                    for chunk in iter_document_chunks(_labelled_pages(path, page_lists), doc_hash, doc_index, _source_name(path)):
+                        desired_hashes.add(doc_hash)
+                        n_chunks += 1
+                        yield chunk
+                    progress("chunk", docs_chunked, len(to_extract), chunks=n_chunks)
 
-    def generate_summary(self):
+            totals = upsert_chunk_stream(
+                _new_chunks(), self.embed_model, staging,
+                reuse_from=live if mode == "incremental" else None,
+                progress_fn=progress
+            )
+
+            # A document that failed part-way must not stay half-ingested
+            for doc_hash in failed_hashes:
+                if doc_hash in desired_hashes:
+                    staging.delete(where={"doc_hash": doc_hash})
+                    desired_hashes.discard(doc_hash)
+
+            if not desired_hashes:
+                self.client.delete_collection(name=staging_name)
+                return "Error: No text could be extracted from any of the uploaded files."
+
+            print(f"New chunks: {totals['chunks']}, unchanged documents: {len(kept_docs)}")
+            removed = sum(len(ids) for h, ids in existing.items() if h not in desired_hashes)
+
+            # Lexical index for the new corpus, built before the swap so both switch together
+            progress("index", 0, 0)
+            lexical = BM25Index.build_from_collection(staging)
+            # The local vector index is only built up front when it is the primary backend;
+            # otherwise it is loaded lazily the first time Chroma queries fail
+            vectors = MatrixIndex.from_collection(staging) if VECTOR_BACKEND == "local" else None
+            if vectors is not None:
+                vectors.measure_recall()
+
+            # Index files are keyed by the physical name, so they can be written before the swap
+            lexical.save(lexical_index_path(staging_name))
+            if vectors is not None and PERSIST_VECTOR_INDEX:
+                vectors.save(vector_index_path(staging_name))
+                vectors = MatrixIndex.load(vector_index_path(staging_name), mmap=True)
+
+            # 4. Atomic swap: moving the generation pointer is the commit point. This worker switches
+            #    handles right away, the others on their next request (Namespace._sync_generation)
+            new_generation = bump_generation(ns.collection_name)
+            ns.collection = staging
+            ns.lexical_index = lexical
+            ns.vector_index = vectors
+            ns.invalidate_corpus_caches()
+            ns._generation = new_generation
+            ns.touch()
+            ns.persist_last_used()
+            self._drop_old_generations(ns.collection_name, keep_from=generation)
+
+        total_chunks = staging.count()
+        return (
+            f"Successfully processed {len(file_paths)} files. Merged into {total_chunks} chunks "
+            f"({totals['encoded']} embedded, {totals['chunks'] - totals['encoded']} reused, {removed} removed)."
+        )
+
+    def _open_namespace(self, session_id: str):
+        """(namespace, collection). Both may open the store or touch the disk, so async callers run this in a thread."""
+        ns = self.namespace(session_id)
+        return ns, ns.collection
+
+    async def agenerate_summary(self, session_id: str = DEFAULT_NAMESPACE):
         """Concept 2: Summary"""
         print("Starting Summary Generation...")
-        result = summarize_entire_collection_map_reduce(
-            collection=self.collection,
-            call_llm_fn=call_llm_text_only,
-            batch_size=6 
+        ns, collection = await asyncio.to_thread(self._open_namespace, session_id)
+        result = await ns.asummarize_cached(
+            collection=collection,
+            acall_llm_fn=acall_llm_text_only,
+            batch_size=6
         )
         return result["final_summary"]
 
-    def chat(self, query):
-        """Concept 3: Q&A"""
+    def _cached_answer(self, ns: Namespace, query, where):
+        """Looks the question up in the namespace's answer cache. Returns (hit, fingerprint, query embedding)."""
+        fingerprint = ns.corpus_fingerprint()
+        # The embedding is cached, so retrieval on a miss does not encode the question again
+        embedding = self.query_embedder.encode(query, convert_to_numpy=True) if ANSWER_CACHE_SEMANTIC else None
+        return ns.answer_cache.get(fingerprint, query, where, embedding=embedding), fingerprint, embedding
+
+    @staticmethod
+    def _cacheable(result) -> bool:
+        # Wikipedia fallbacks are not pinned: the corpus may answer once the LLM/provider recovers
+        return bool(result.get("answer")) and not result.get("telemetry", {}).get("wikipedia_fallback")
+
+    async def achat(self, query, session_id: str = DEFAULT_NAMESPACE, where=None):
+        """Concept 3: Q&A. Returns the answer dict; from_cache is set when it was served from the answer cache.
+        Blocking lookups run in worker threads, the answer LLM call is awaited."""
         print(f"Chat Query: {query}")
-        result = answer_question_rag(
-            question=query, 
-            collection=self.collection, 
-            embed_model=self.embed_model,
-            call_llm_fn=call_llm_answer
+        ns = await asyncio.to_thread(self.namespace, session_id)
+        hit, fingerprint, embedding = await asyncio.to_thread(self._cached_answer, ns, query, where)
+        if hit:
+            cached, kind = hit
+            print(f"[Chat] Answer cache hit ({kind})")
+            return dict(cached, question=query, from_cache=True, cache_match=kind)
+
+        # Opening the collection / lexical index may hit the disk and the first query_embedder
+        # access may load the model, so all handles are resolved off the event loop
+        collection, lexical_index, query_embedder = await asyncio.to_thread(lambda: (ns.collection, ns.lexical_index, self.query_embedder))
+        result = await aanswer_question_rag(
+            question=query,
+            collection=collection,
+            embed_model=query_embedder,
+            where=where,
+            lexical_index=lexical_index,
+            local_index_fn=lambda: ns.vector_index,
+            acall_llm_fn=acall_llm_text_only
         )
-        return result["answer"]
-    
-    # ... inside RAGService class ...
+        if self._cacheable(result):
+            ns.answer_cache.put(fingerprint, query, where, result, embedding=embedding)
+        return dict(result, from_cache=False)
 
-    def generate_quiz(self):
-        """Concept 4: Quiz (Generates AND Saves)"""
-        print("Generating Quiz...")
-        quiz_data = quiz_from_full_summary(
-            collection=self.collection,
-            embed_model=self.embed_model,
+    def chat_stream(self, query, session_id: str = DEFAULT_NAMESPACE, where=None):
+        """Concept 3: Q&A, streamed as sources -> tokens -> done events"""
+        print(f"Chat Query (stream): {query}")
+        ns = self.namespace(session_id)
+        hit, fingerprint, embedding = self._cached_answer(ns, query, where)
+        if hit:
+            cached, kind = hit
+            print(f"[Chat] Answer cache hit ({kind})")
+            yield {"event": "sources", "data": cached["sources"]}
+            yield {"event": "token", "data": cached["answer"]}
+            yield {"event": "done", "data": {"from_cache": True, "cache_match": kind}}
+            return
+
+        answer_parts, sources = [], []
+        for item in stream_answer_question_rag(
+            question=query,
+            collection=ns.collection,
+            embed_model=self.query_embedder,
             call_llm_fn=call_llm_answer,
-            summarizer_fn=summarize_entire_collection_map_reduce
-        )
-        
-        # --- NEW: SAVE TO DISK ---
-        # We try to find a source filename from the collection metadata to name the file
-        try:
-            # Get the first chunk's metadata to find the source name
-            # We stored it like "filename.pdf (Page 1)" in process_files
-            existing_chunks = self.collection.get(limit=1)
-            if existing_chunks['metadatas'] and len(existing_chunks['metadatas']) > 0:
-                # Extract filename from "filename.pdf (Page X)" logic if you used that, 
-                # or just use a default name.
-                # Since we didn't strictly store clean filenames in metadata in the previous step,
-                # let's generate a name based on the first document text or timestamp.
-                # BETTER: Let's assume the user just processed a file.
-                pass
-        except:
-            pass
-            
-        # For simplicity, we will save it with a generic name or pass the name from the API.
-        # But here, let's just return data. The API (main.py) allows renaming.
-        return quiz_data
+            where=where,
+            lexical_index=ns.lexical_index,
+            local_index_fn=lambda: ns.vector_index
+        ):
+            if item["event"] == "sources":
+                sources = item["data"]
+            elif item["event"] == "token":
+                answer_parts.append(item["data"])
+            elif item["event"] == "reset":
+                answer_parts.clear()
+            elif item["event"] == "done":
+                item["data"]["from_cache"] = False
+                # Only a fully streamed answer is cached; a client disconnect never reaches this point
+                result = {"question": query, "answer": "".join(answer_parts).strip(), "sources": sources, "telemetry": dict(item["data"])}
+                if self._cacheable(result):
+                    ns.answer_cache.put(fingerprint, query, where, result, embedding=embedding)
+            yield item
     
     def save_current_summary(self, filename: str, summary_text: str):
         return save_summary_to_disk(filename, summary_text)
@@ -156,14 +668,14 @@ class RAGService:
     def load_quiz(self, filename: str):
         return load_quiz_from_disk(filename)
 
-    def generate_quiz(self):
+    async def agenerate_quiz(self, session_id: str = DEFAULT_NAMESPACE):
         """Concept 4: Quiz"""
         print("Generating Quiz...")
-        return quiz_from_full_summary(
-            collection=self.collection,
-            embed_model=self.embed_model,
-            call_llm_fn=call_llm_answer,
-            summarizer_fn=summarize_entire_collection_map_reduce
+        ns, collection = await asyncio.to_thread(self._open_namespace, session_id)
+        return await aquiz_from_full_summary(
+            collection=collection,
+            acall_llm_fn=acall_llm_answer,
+            summarizer_fn=lambda collection, **kwargs: ns.asummarize_cached(collection, acall_llm_text_only, **kwargs)
         )
 
-rag_service = RAGService()
\ No newline at end of file
+rag_service = RAGService()
@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Any, Iterator
+
+from .config import LLM_REQUESTS_PER_MIN, LLM_TOKENS_PER_MIN
+from .token_budget import token_estimator
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0      # chat answers, query variants, quiz questions
+PRIORITY_BACKGROUND = 10      # summary map / compression / reduce calls
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+# Priority of the LLM calls made by the current thread / task (see llm_priority_scope)
+llm_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+@contextlib.contextmanager
+def llm_priority_scope(priority: int) -> Iterator[None]:
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+def estimate_tokens(text: str) -> int:
+    """Prompt token count from the calibrated estimator."""
+    return token_estimator.count(text)
+
+
+class RateLimiter:
+    """
+    Process-wide scheduler in front of the LLM provider: a dual token bucket (requests/min +
+    tokens/min) with a priority queue. Callers are admitted strictly in (priority, arrival) order,
+    so interactive calls overtake queued background work but never starve behind it.
+    acquire() blocks the calling thread; acquire_async() awaits instead. backoff() pauses the
+    whole queue when the provider answers 429 anyway.
+    """
+    def __init__(self, requests_per_min: int = LLM_REQUESTS_PER_MIN, tokens_per_min: int = LLM_TOKENS_PER_MIN):
+        self.requests_per_min = max(1, int(requests_per_min))
+        self.tokens_per_min = max(1, int(tokens_per_min))
+        self._req_available = float(self.requests_per_min)
+        self._tok_available = float(self.tokens_per_min)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._queue: list = []                  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self.total_wait_seconds = 0.0
+        self.acquired = 0
+        self.throttled = 0
+        self._per_priority: Dict[int, Dict[str, float]] = {}
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._req_available = min(self.requests_per_min, self._req_available + elapsed * self.requests_per_min / 60.0)
+        self._tok_available = min(self.tokens_per_min, self._tok_available + elapsed * self.tokens_per_min / 60.0)
+
+    def _wait_time(self, tokens: int) -> float:
+        """Seconds until both buckets can cover the request (0 if it can go now)."""
+        req_missing = max(0.0, 1.0 - self._req_available)
+        tok_missing = max(0.0, tokens - self._tok_available)
+        blocked = max(0.0, self._blocked_until - time.monotonic())
+        return max(blocked, req_missing * 60.0 / self.requests_per_min, tok_missing * 60.0 / self.tokens_per_min)
+
+    def _cap(self, tokens: int) -> int:
+        # A single call larger than the whole budget would wait forever; cap it at one full bucket
+        return min(max(0, int(tokens)), self.tokens_per_min)
+
+    def _enqueue(self, priority: int):
+        with self._lock:
+            ticket = (int(priority), next(self._seq))
+            heapq.heappush(self._queue, ticket)
+            return ticket
+
+    def _try_acquire(self, ticket, tokens: int, started: float) -> float:
+        """Must hold the lock. Admits the ticket and returns 0, or returns seconds to wait before retrying."""
+        if self._queue[0] != ticket:
+            # Someone ahead in line; the head wakes us when it is admitted
+            return 0.05
+        self._refill()
+        wait = self._wait_time(tokens)
+        if wait > 0:
+            return min(wait, 1.0)
+        heapq.heappop(self._queue)
+        self._req_available -= 1.0
+        self._tok_available -= tokens
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait_seconds += waited
+        stats = self._per_priority.setdefault(ticket[0], {"acquired": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0})
+        stats["acquired"] += 1
+        stats["total_wait_seconds"] += waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+        self._wakeup.notify_all()
+        return 0.0
+
+    def _abandon(self, ticket):
+        # Cancelled / failed waiter: leave the line so it does not block everyone behind it
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._wakeup.notify_all()
+
+    def acquire(self, tokens: int = 0, priority: int = None):
+        tokens = self._cap(tokens)
+        ticket = self._enqueue(llm_priority.get() if priority is None else priority)
+        started = time.monotonic()
+        try:
+            with self._lock:
+                while True:
+                    wait = self._try_acquire(ticket, tokens, started)
+                    if not wait:
+                        return
+                    self._wakeup.wait(wait)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def acquire_async(self, tokens: int = 0, priority: int = None):
+        """Same queue and budget as acquire(), but waits with asyncio.sleep so the event loop keeps running."""
+        tokens = self._cap(tokens)
+        ticket = self._enqueue(llm_priority.get() if priority is None else priority)
+        started = time.monotonic()
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire(ticket, tokens, started)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def backoff(self, seconds: float):
+        """The provider throttled us anyway: hold every queued call for `seconds` and drain the buckets."""
+        with self._lock:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + max(0.0, seconds))
+            self._req_available = min(self._req_available, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill()
+            depth: Dict[str, int] = {}
+            for priority, _ in self._queue:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                depth[name] = depth.get(name, 0) + 1
+            return {
+                "requests_per_min": self.requests_per_min,
+                "tokens_per_min": self.tokens_per_min,
+                "requests_available": round(self._req_available, 2),
+                "tokens_available": int(self._tok_available),
+                "acquired": self.acquired,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+                "throttled": self.throttled,
+                "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+                "queue_depth": len(self._queue),
+                "queue_depth_by_priority": depth,
+                "by_priority": {
+                    PRIORITY_NAMES.get(priority, str(priority)): {
+                        "acquired": int(s["acquired"]),
+                        "avg_wait_seconds": round(s["total_wait_seconds"] / s["acquired"], 3) if s["acquired"] else 0.0,
+                        "max_wait_seconds": round(s["max_wait_seconds"], 3),
+                    }
+                    for priority, s in self._per_priority.items()
+                },
+            }
+
+
+# Shared by every caller in the process so concurrent endpoints draw from one budget
+provider_rate_limiter = RateLimiter()
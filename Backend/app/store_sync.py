@@ -0,0 +1,58 @@
+import contextlib
+import os
+import threading
+from typing import Iterator
+
+from .config import STORE_SYNC_DIR
+
+try:
+    import fcntl
+except ImportError:          # Windows: single-process deployments only
+    fcntl = None
+
+
+def _path(name: str, suffix: str) -> str:
+    os.makedirs(STORE_SYNC_DIR, exist_ok=True)
+    return os.path.join(STORE_SYNC_DIR, f"{name}.{suffix}")
+
+@contextlib.contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Exclusive flock on `path` (created if missing); a no-op where fcntl is unavailable."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a+") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def interprocess_lock(name: str):
+    """Exclusive lock shared by every worker process on this host (flock on a lock file)."""
+    return file_lock(_path(name, "lock"))
+
+_generation_lock = threading.Lock()
+
+def bump_generation(name: str) -> int:
+    """
+    Moves corpus `name` to its next generation (the live physical collection, see
+    rag_engine.versioned_collection_name). Other workers notice on their next access.
+    Callers hold interprocess_lock(name), so the read-increment-write is not racy across processes.
+    """
+    path = _path(name, "generation")
+    with _generation_lock:
+        generation = read_generation(name) + 1
+        with open(path + ".tmp", "w") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return generation
+
+def read_generation(name: str) -> int:
+    try:
+        with open(os.path.join(STORE_SYNC_DIR, f"{name}.generation"), "r") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
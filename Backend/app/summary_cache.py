@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Any, Optional, Tuple
+
+
+class SummaryCache:
+    """
+    Keeps map-reduce summary artifacts (intermediate + final summaries) per corpus fingerprint,
+    so /summarize and /quiz on the same corpus only pay for the map-reduce once.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: Dict[Tuple, Dict[str, Any]] = {}
+        self._async_key_locks: Dict[Tuple, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._results.get(key)
+
+    async def aget_or_compute(self, key: Tuple, compute_fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Cached result for key, or awaits compute_fn once: concurrent awaiters for the same key share one computation."""
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                return self._results[key]
+            key_lock = self._async_key_locks.setdefault(key, asyncio.Lock())
+
+        async with key_lock:
+            with self._lock:
+                if key in self._results:
+                    self.hits += 1
+                    return self._results[key]
+                self.misses += 1
+            result = await compute_fn()
+            if self._cacheable(result):
+                with self._lock:
+                    self._results[key] = result
+            return result
+
+    @staticmethod
+    def _cacheable(result: Dict[str, Any]) -> bool:
+        # Don't pin failed runs; the next request should retry
+        return bool(result.get("final_summary")) and result["final_summary"] != "Error generating summary."
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._async_key_locks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._results), "hits": self.hits, "misses": self.misses}
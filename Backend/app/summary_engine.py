@@ -1,14 +1,101 @@
-import math
-import time
-from typing import Callable, Dict, Any, List
+import asyncio
+from typing import Awaitable, Callable, Dict, Any, List
 from .core_utils import get_all_chunks_from_collection
+from .config import SUMMARY_MAP_CONCURRENCY, SUMMARY_BATCH_TOKENS
+from .rate_limiter import PRIORITY_BACKGROUND, estimate_tokens, llm_priority_scope
+from .llm_async import gather_limited
+from .token_budget import pack_context, token_estimator
 
-def summarize_entire_collection_map_reduce(
+# 1. INTERMEDIATE STEP: Same as before (Get the facts)
+DEFAULT_INTERMEDIATE_INSTRUCTION = (
+    "Using ONLY the provided context, write a detailed explanation of all important ideas. "
+    "DO NOT include any '(source: ...)' or chunk IDs. "
+    "Summaries should be factual and complete, 6–10 sentences each. "
+    "Return only the rewritten explanation."
+)
+
+# 2. FINAL STEP: UPDATED FOR DYNAMIC TOPICS
+DEFAULT_FINAL_INSTRUCTION = (
+    "You are a professional technical writer. "
+    "Using ONLY the information inside the intermediate summaries provided, create a comprehensive, "
+    "well-structured document summary.\n\n"
+    "INSTRUCTIONS:\n"
+    "1. Do NOT use generic or fixed headings. Instead, **generate your own descriptive headings** "
+    "   that perfectly match the specific topics discussed in the text.\n"
+    "2. Start with a broad **Overview** section.\n"
+    "3. Organize the rest of the content into logical sections based on the themes found in the text.\n"
+    "4. Ensure the summary flows naturally like a professionally written report.\n"
+    "5. Do NOT mention chunk IDs, source numbers, or internal metadata.\n\n"
+    "Goal: A structured, easy-to-read report that adapts its outline to the content."
+)
+
+COMPRESS_INSTRUCTION = (
+    "You are given multiple intermediate summaries. For each INTERMEDIATE_SUMMARY_x: "
+    "Produce a very short compressed summary (1-2 sentences) that preserves the main point. "
+    "Return each compressed summary in the same order, separated by a blank line."
+)
+
+# Prompt building / parsing for the map-reduce driver
+def _snippet(c: Dict[str, Any], snippet_max_chars: int) -> Dict[str, Any]:
+    text = c.get("text", "") or ""
+    return dict(c, text=text if len(text) <= snippet_max_chars else text[:snippet_max_chars] + "...")
+
+def _batch_prompt(batch: List[Dict[str, Any]], instruction: str, snippet_max_chars: int) -> str:
+    # Batches hold consecutive chunks, so the chunker's overlap is dropped instead of sent twice
+    blocks, _ = pack_context(
+        [_snippet(c, snippet_max_chars) for c in batch], budget_tokens=10 ** 9,
+        render=lambda c, text: f"SOURCE_ID: {c['id']}\n{text}"
+    )
+    context = "\n\n---\n\n".join(blocks)
+    return f"{instruction}\n\nContext:\n{context}\n\nReturn the summary only."
+
+def _compress_prompt(offset: int, batch_slice: List[str]) -> str:
+    batch_context = "\n\n".join([f"INTERMEDIATE_SUMMARY_{offset + idx}:\n{txt}" for idx, txt in enumerate(batch_slice)])
+    return f"{COMPRESS_INSTRUCTION}\n\n{batch_context}\n\nReturn only the compressed summaries in order."
+
+def _split_compressed(comp_resp: str, batch_slice: List[str]) -> List[str]:
+    parts = [p.strip() for p in comp_resp.split("\n\n") if p.strip()]
+    return [parts[j] if j < len(parts) else batch_slice[j] for j in range(len(batch_slice))]
+
+def _combine_intermediates(texts: List[str]) -> str:
+    return "\n\n".join([f"INTERMEDIATE_SUMMARY_{idx}:\n{txt}" for idx, txt in enumerate(texts)])
+
+def _final_prompt(final_instruction: str, combined_intermediates: str) -> str:
+    return f"{final_instruction}\n\nContext (Intermediate Summaries):\n{combined_intermediates}\n\nReturn the final structured summary."
+
+def _ordered_batches(all_chunks: List[Dict[str, Any]], batch_size: int, batch_tokens: int = SUMMARY_BATCH_TOKENS) -> List[List[Dict[str, Any]]]:
+    """Document-ordered batches of at most batch_size chunks, also closed once batch_tokens would be exceeded."""
+    try:
+        all_chunks_sorted = sorted(all_chunks, key=lambda c: (c.get("metadata", {}).get("doc_index", 0), c.get("metadata", {}).get("start_char", 0)))
+    except Exception:
+        all_chunks_sorted = all_chunks
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_tokens = 0
+    for c in all_chunks_sorted:
+        tokens = estimate_tokens(c.get("text") or "")
+        if current and (len(current) >= batch_size or current_tokens + tokens > batch_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(c)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _fit_to_budget(combined_intermediates: str, allowed_tokens: int, show_progress: bool) -> str:
+    """Last resort after the compression rounds: never send a reduce prompt that overflows the model."""
+    if estimate_tokens(combined_intermediates) <= allowed_tokens:
+        return combined_intermediates
+    if show_progress: print(f"[Reduce] Still over budget after compression; cutting to {allowed_tokens} tokens")
+    return combined_intermediates[:token_estimator.chars_for(allowed_tokens)]
+
+async def asummarize_entire_collection_map_reduce(
     collection,
-    call_llm_fn: Callable[[str, int, float], str],
+    acall_llm_fn: Callable[[str, int, float], Awaitable[str]],
     batch_size: int = 6,
     intermediate_max_tokens: int = 512,
-    final_max_tokens: int = 1500,  # Increased for better detail
+    final_max_tokens: int = 1500,
     intermediate_instruction: str = None,
     final_instruction: str = None,
     snippet_max_chars: int = 1500,
@@ -18,129 +105,82 @@ def summarize_entire_collection_map_reduce(
     temperature: float = 0.0,
     model_token_limit: int = 8000,
     compression_batch_size: int = 8,
-    compression_max_rounds: int = 3
+    compression_max_rounds: int = 3,
+    max_concurrency: int = SUMMARY_MAP_CONCURRENCY,
+    priority: int = PRIORITY_BACKGROUND
 ) -> Dict[str, Any]:
-    
-    # 1. INTERMEDIATE STEP: Same as before (Get the facts)
+    """
+    Map-reduce summary of the whole collection: batches of consecutive chunks are summarized
+    concurrently (map), compressed in rounds while the combined text exceeds the model budget,
+    then reduced to one structured summary. LLM calls are gathered on the event loop and run at
+    background priority; scheduler / retry waits are asyncio sleeps.
+    """
     if intermediate_instruction is None:
-        intermediate_instruction = (
-            "Using ONLY the provided context, write a detailed explanation of all important ideas. "
-            "DO NOT include any '(source: ...)' or chunk IDs. "
-            "Summaries should be factual and complete, 6–10 sentences each. "
-            "Return only the rewritten explanation."
-        )
-
-    # 2. FINAL STEP: UPDATED FOR DYNAMIC TOPICS
+        intermediate_instruction = DEFAULT_INTERMEDIATE_INSTRUCTION
     if final_instruction is None:
-        final_instruction = (
-            "You are a professional technical writer. "
-            "Using ONLY the information inside the intermediate summaries provided, create a comprehensive, "
-            "well-structured document summary.\n\n"
-            "INSTRUCTIONS:\n"
-            "1. Do NOT use generic or fixed headings. Instead, **generate your own descriptive headings** "
-            "   that perfectly match the specific topics discussed in the text.\n"
-            "2. Start with a broad **Overview** section.\n"
-            "3. Organize the rest of the content into logical sections based on the themes found in the text.\n"
-            "4. Ensure the summary flows naturally like a professionally written report.\n"
-            "5. Do NOT mention chunk IDs, source numbers, or internal metadata.\n\n"
-            "Goal: A structured, easy-to-read report that adapts its outline to the content."
-        )
-
-    # ... (The rest of the function logic remains exactly the same) ...
-
-    # Internal helper: robustly fetch chunks from Chroma collection
-    def _estimate_tokens_from_text(text: str) -> int:
-        if not text: return 0
-        return max(1, int(len(text) / 4))
-
-    def _compress_intermediates(intermediates: List[str], round_idx: int) -> List[str]:
-        compressed = []
-        if not intermediates: return compressed
-        for i in range(0, len(intermediates), compression_batch_size):
-            batch_slice = intermediates[i:i + compression_batch_size]
-            batch_context = "\n\n".join([f"INTERMEDIATE_SUMMARY_{i + idx}:\n{txt}" for idx, txt in enumerate(batch_slice)])
-            compress_instruction = (
-                "You are given multiple intermediate summaries. For each INTERMEDIATE_SUMMARY_x: "
-                "Produce a very short compressed summary (1-2 sentences) that preserves the main point. "
-                "Return each compressed summary in the same order, separated by a blank line."
-            )
-            compress_prompt = f"{compress_instruction}\n\n{batch_context}\n\nReturn only the compressed summaries in order."
-            try:
-                comp_resp = call_llm_fn(compress_prompt, intermediate_max_tokens, temperature)
-                comp_resp = comp_resp.strip() if isinstance(comp_resp, str) else str(comp_resp).strip()
-            except Exception as e:
-                if show_progress: print(f"[Compress] LLM compression failed (round {round_idx}): {e}")
-                comp_resp = "\n\n".join(batch_slice)
-            parts = [p.strip() for p in comp_resp.split("\n\n") if p.strip()]
-            for j in range(len(batch_slice)):
-                if j < len(parts): compressed.append(parts[j])
-                else: compressed.append(batch_slice[j])
-            time.sleep(0.05)
-        return compressed
-
-    all_chunks = get_all_chunks_from_collection(collection)
-    if not all_chunks:
-        raise ValueError("No chunks found in collection.")
+        final_instruction = DEFAULT_FINAL_INSTRUCTION
 
-    try:
-        all_chunks_sorted = sorted(all_chunks, key=lambda c: c.get("metadata", {}).get("start_char", 0))
-    except Exception:
-        all_chunks_sorted = all_chunks
+    async def _call_llm_limited(prompt: str, max_tokens: int):
+        with llm_priority_scope(priority):
+            return await acall_llm_fn(prompt, max_tokens, temperature)
+
+    async def _compress_one(job) -> List[str]:
+        offset, batch_slice, round_idx = job
+        try:
+            comp_resp = await _call_llm_limited(_compress_prompt(offset, batch_slice), intermediate_max_tokens)
+            comp_resp = comp_resp.strip() if isinstance(comp_resp, str) else str(comp_resp).strip()
+        except Exception as e:
+            if show_progress: print(f"[Compress] LLM compression failed (round {round_idx}): {e}")
+            comp_resp = "\n\n".join(batch_slice)
+        return _split_compressed(comp_resp, batch_slice)
 
-    batches = [all_chunks_sorted[i:i + batch_size] for i in range(0, len(all_chunks_sorted), batch_size)]
-    intermediate_summaries = []
-
-    for batch_idx, batch in enumerate(batches):
-        context_parts = []
-        for c in batch:
-            text = c.get("text", "") or ""
-            snippet = text if len(text) <= snippet_max_chars else text[:snippet_max_chars] + "..."
-            context_parts.append(f"SOURCE_ID: {c['id']}\n{snippet}")
-        context = "\n\n---\n\n".join(context_parts)
-        prompt = f"{intermediate_instruction}\n\nContext:\n{context}\n\nReturn the summary only."
-        
+    async def _summarize_batch(job) -> Dict[str, Any]:
+        batch_idx, batch = job
+        prompt = _batch_prompt(batch, intermediate_instruction, snippet_max_chars)
         if show_progress: print(f"[Map] Summarizing batch {batch_idx+1}/{len(batches)}...")
-        
+
         intermediate = ""
-        attempt = 0
-        while attempt <= llm_retry:
+        for attempt in range(llm_retry + 1):
             try:
-                intermediate = call_llm_fn(prompt, intermediate_max_tokens, temperature)
+                intermediate = await _call_llm_limited(prompt, intermediate_max_tokens)
                 if isinstance(intermediate, str): intermediate = intermediate.strip()
                 if intermediate: break
             except Exception as e:
                 if show_progress: print(f"LLM call failed attempt {attempt+1}: {e}")
-            attempt += 1
-            time.sleep(retry_backoff * attempt)
-        
+            await asyncio.sleep(retry_backoff * (attempt + 1))
+
         if not intermediate: intermediate = "[EMPTY SUMMARY]"
-        intermediate_summaries.append({"batch_idx": batch_idx, "summary": intermediate})
+        return {"batch_idx": batch_idx, "summary": intermediate}
 
-    intermediate_texts = [it["summary"] for it in intermediate_summaries]
-    combined_intermediates = "\n\n".join([f"INTERMEDIATE_SUMMARY_{idx}:\n{txt}" for idx, txt in enumerate(intermediate_texts)])
-    estimated_tokens = _estimate_tokens_from_text(combined_intermediates)
-    allowed_tokens = max(0, model_token_limit - final_max_tokens - 128)
+    # Chroma reads are blocking; keep them off the event loop
+    all_chunks = await asyncio.to_thread(get_all_chunks_from_collection, collection)
+    if not all_chunks:
+        raise ValueError("No chunks found in collection.")
+
+    batches = _ordered_batches(all_chunks, batch_size)
+    intermediate_summaries = await gather_limited(_summarize_batch, list(enumerate(batches)), max_concurrency)
 
+    compressed_texts = [it["summary"] for it in intermediate_summaries]
+    combined_intermediates = _combine_intermediates(compressed_texts)
+    estimated_tokens = estimate_tokens(combined_intermediates)
+    allowed_tokens = max(0, model_token_limit - final_max_tokens - 128)
     if show_progress: print(f"[Reduce] Estimated tokens: {estimated_tokens}, Allowed: {allowed_tokens}")
 
-    compressed_texts = intermediate_texts[:]
     round_idx = 0
     while estimated_tokens > allowed_tokens and round_idx < compression_max_rounds:
         round_idx += 1
         if show_progress: print(f"[Compress] Round {round_idx}...")
-        compressed_texts = _compress_intermediates(compressed_texts, round_idx)
-        combined_intermediates = "\n\n".join([f"INTERMEDIATE_SUMMARY_{idx}:\n{txt}" for idx, txt in enumerate(compressed_texts)])
-        estimated_tokens = _estimate_tokens_from_text(combined_intermediates)
+        jobs = [(i, compressed_texts[i:i + compression_batch_size], round_idx) for i in range(0, len(compressed_texts), compression_batch_size)]
+        compressed_texts = [text for part in await gather_limited(_compress_one, jobs, max_concurrency) for text in part]
+        combined_intermediates = _combine_intermediates(compressed_texts)
+        estimated_tokens = estimate_tokens(combined_intermediates)
 
-    # Final Reduce Call
-    final_prompt = f"{final_instruction}\n\nContext (Intermediate Summaries):\n{combined_intermediates}\n\nReturn the final structured summary."
-    
+    combined_intermediates = _fit_to_budget(combined_intermediates, allowed_tokens, show_progress)
     if show_progress: print("[Reduce] Generating Final Dynamic Summary...")
-    
     final_summary = ""
     try:
-        final_summary = call_llm_fn(final_prompt, final_max_tokens, temperature)
+        final_summary = await _call_llm_limited(_final_prompt(final_instruction, combined_intermediates), final_max_tokens)
     except Exception as e:
         if show_progress: print(f"Final LLM Error: {e}")
 
-    return {"intermediate_summaries": intermediate_summaries, "final_summary": final_summary if final_summary else "Error generating summary."}
\ No newline at end of file
+    return {"intermediate_summaries": intermediate_summaries, "final_summary": final_summary if final_summary else "Error generating summary."}
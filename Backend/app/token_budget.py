@@ -0,0 +1,129 @@
+import math
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from .config import TOKEN_CHARS_PER_TOKEN
+
+
+class TokenEstimator:
+    """
+    Calibrated token counter. The provider's model tokenizer is not available locally, so counts
+    are len(text) / chars_per_token, where chars_per_token is an exponential moving average of
+    what the provider actually billed (observe() is fed the reported input_tokens of each call).
+    A 3% safety margin keeps budgets from overflowing while the ratio settles.
+    """
+    def __init__(self, chars_per_token: float = TOKEN_CHARS_PER_TOKEN, alpha: float = 0.1, margin: float = 1.03):
+        self.chars_per_token = chars_per_token
+        self.alpha = alpha
+        self.margin = margin
+        self._lock = threading.Lock()
+        self.observations = 0
+
+    def count(self, text: str) -> int:
+        if not text: return 0
+        return max(1, math.ceil(len(text) * self.margin / self.chars_per_token))
+
+    def chars_for(self, tokens: int) -> int:
+        """Largest text length (chars) estimated to fit in `tokens`."""
+        return max(0, int(tokens * self.chars_per_token / self.margin))
+
+    def observe(self, text: str, actual_tokens: Optional[int]):
+        # Short prompts are dominated by fixed per-message overhead; they would skew the ratio
+        if not actual_tokens or len(text or "") < 200:
+            return
+        ratio = min(8.0, max(1.5, len(text) / float(actual_tokens)))
+        with self._lock:
+            self.chars_per_token += self.alpha * (ratio - self.chars_per_token)
+            self.observations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"chars_per_token": round(self.chars_per_token, 3), "observations": self.observations}
+
+
+token_estimator = TokenEstimator()
+
+
+def overlap_length(before: str, after: str, max_overlap: int = 400, min_overlap: int = 24) -> int:
+    """Length of the longest suffix of `before` that is also a prefix of `after` (0 if shorter than min_overlap)."""
+    limit = min(len(before), len(after), max_overlap)
+    for n in range(limit, min_overlap - 1, -1):
+        if before.endswith(after[:n]):
+            return n
+    return 0
+
+def _same_document(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    ma, mb = a.get("metadata") or {}, b.get("metadata") or {}
+    if ma.get("doc_hash") and mb.get("doc_hash"):
+        return ma["doc_hash"] == mb["doc_hash"]
+    return True
+
+def _cut(text: str, max_chars: int) -> str:
+    """Cuts text to max_chars on a word boundary, marking the cut."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - 3)]
+    space = cut.rfind(" ")
+    if space > len(cut) * 0.8:
+        cut = cut[:space]
+    return cut.rstrip() + "..."
+
+def pack_context(
+    items: List[Dict[str, Any]],
+    budget_tokens: int,
+    render: Callable[[Dict[str, Any], str], str],
+    separator: str = "\n\n---\n\n",
+    estimator: TokenEstimator = token_estimator,
+    min_tail_tokens: int = 48,
+) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Packs chunk texts into a token budget, in the given (relevance) order.
+    - Text a chunk shares with an already packed neighbour (the chunker's overlap) is dropped
+      from the later one, whichever side of the neighbour it is on.
+    - Chunks are added whole while they fit; the first one that does not is cut to the
+      remaining budget (if at least min_tail_tokens remain) and packing stops.
+    render(item, text) returns the block for one chunk (e.g. with its SOURCE_ID header).
+    Returns (blocks, stats).
+    """
+    blocks: List[str] = []
+    packed: List[Tuple[Dict[str, Any], str]] = []
+    used = 0
+    trimmed_chars = 0
+    sep_tokens = estimator.count(separator)
+    for item in items:
+        text = item.get("text") or ""
+        for other, other_text in packed:
+            if not _same_document(item, other):
+                continue
+            head = overlap_length(other_text, text)      # item continues `other`
+            if head:
+                text = text[head:].lstrip()
+                trimmed_chars += head
+            tail = overlap_length(text, other_text)      # item precedes `other`
+            if tail:
+                text = text[:-tail].rstrip()
+                trimmed_chars += tail
+        if not text.strip():
+            continue
+
+        cost = estimator.count(render(item, text)) + (sep_tokens if blocks else 0)
+        if used + cost <= budget_tokens:
+            blocks.append(render(item, text))
+            packed.append((item, text))
+            used += cost
+            continue
+
+        remaining = budget_tokens - used - (sep_tokens if blocks else 0) - estimator.count(render(item, ""))
+        if remaining >= min_tail_tokens:
+            part = _cut(text, estimator.chars_for(remaining))
+            blocks.append(render(item, part))
+            packed.append((item, part))
+            used += estimator.count(blocks[-1]) + (sep_tokens if len(blocks) > 1 else 0)
+        break
+
+    return blocks, {
+        "chunks": len(blocks),
+        "candidates": len(items),
+        "tokens": used,
+        "budget": budget_tokens,
+        "overlap_chars_removed": trimmed_chars,
+    }
@@ -0,0 +1,211 @@
+import json
+import os
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .config import VECTOR_INDEX_DIR, VECTOR_INDEX_DTYPE, VECTOR_RERANK_FACTOR
+
+INDEX_DTYPES = ("float32", "float16", "int8")
+
+
+class MatrixIndex:
+    """
+    Cosine-similarity index over the collection's stored embeddings.
+
+    Vectors are L2-normalized once at load time, so a query is a single matrix-vector
+    product plus argpartition for the top-k. The matrix can be memory-mapped from disk.
+    Distances are reported as squared L2 between unit vectors (2 - 2*cos), the same scale
+    Chroma returns for normalized embeddings.
+
+    With dtype "float16" or "int8" (symmetric, one scale per row) a compact copy of the matrix
+    is scanned first and only a shortlist of k * rerank_factor rows is re-scored against the
+    exact float32 vectors. Persisted and memory-mapped, only the compact copy stays resident.
+    """
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]], matrix: np.ndarray, dtype: str = "float32", codes: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None, rerank_factor: int = VECTOR_RERANK_FACTOR):
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"Unknown vector index dtype {dtype!r}; expected one of {INDEX_DTYPES}")
+        self.ids = list(ids)
+        self.texts = list(texts)
+        self.metadatas = [m or {} for m in metadatas]
+        self.matrix = matrix
+        self.dtype = dtype
+        self.rerank_factor = max(1, int(rerank_factor))
+        self.recall: Optional[Dict[str, Any]] = None
+        self._row_of = {cid: i for i, cid in enumerate(self.ids)}
+        if dtype != "float32" and codes is None:
+            codes, scales = self._compress(matrix, dtype)
+        self.codes = codes
+        self.scales = scales
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if not len(matrix):
+            return matrix
+        return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    @staticmethod
+    def _compress(matrix: np.ndarray, dtype: str, block_rows: int = 16384):
+        """float32 rows -> (codes, per-row scales or None), converted block by block."""
+        codes = np.empty(matrix.shape, dtype=np.float16 if dtype == "float16" else np.int8)
+        scales = np.empty(len(matrix), dtype=np.float32) if dtype == "int8" else None
+        for lo in range(0, len(matrix), block_rows):
+            block = np.asarray(matrix[lo:lo + block_rows], dtype=np.float32)
+            if dtype == "float16":
+                codes[lo:lo + len(block)] = block
+            else:
+                scale = np.clip(np.abs(block).max(axis=1), 1e-12, None) / 127.0
+                codes[lo:lo + len(block)] = np.rint(block / scale[:, None]).astype(np.int8)
+                scales[lo:lo + len(block)] = scale
+        return codes, scales
+
+    @classmethod
+    def from_collection(cls, collection, page_size: int = 500, dtype: str = VECTOR_INDEX_DTYPE) -> "MatrixIndex":
+        """Loads stored embeddings page by page (no re-encoding) into one contiguous float32 matrix."""
+        ids, texts, metas, blocks = [], [], [], []
+        offset = 0
+        while True:
+            res = collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+            page_ids = res.get("ids") or []
+            if not page_ids:
+                break
+            ids.extend(page_ids)
+            texts.extend(res.get("documents") or [])
+            metas.extend(res.get("metadatas") or [{}] * len(page_ids))
+            blocks.append(np.asarray(res["embeddings"], dtype=np.float32))
+            offset += len(page_ids)
+        matrix = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        return cls(ids, texts, metas, cls._normalize(matrix), dtype=dtype)
+
+    def _scores(self, q: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+        """(n_queries, n_chunks) similarities: exact for float32, approximate from the compact copy otherwise."""
+        if self.dtype == "float32":
+            return q @ self.matrix.T
+        sims = np.empty((len(q), len(self.ids)), dtype=np.float32)
+        for lo in range(0, len(self.ids), block_rows):
+            # Upcast one block at a time so the scan never materializes the full float32 matrix
+            sims[:, lo:lo + block_rows] = q @ self.codes[lo:lo + block_rows].astype(np.float32).T
+        if self.scales is not None:
+            sims *= self.scales
+        return sims
+
+    def search(self, q_embs, k: int = 4, allowed_ids: Optional[set] = None) -> List[List[Dict[str, Any]]]:
+        q = self._normalize(np.atleast_2d(np.asarray(q_embs, dtype=np.float32)))
+        if not len(self.ids):
+            return [[] for _ in range(len(q))]
+        sims = self._scores(q)
+        if allowed_ids is not None:
+            mask = np.full(len(self.ids), -np.inf, dtype=np.float32)
+            rows = [self._row_of[cid] for cid in allowed_ids if cid in self._row_of]
+            mask[rows] = 0.0
+            sims = sims + mask
+        out = []
+        for qi, row in enumerate(sims):
+            n_valid = int(np.isfinite(row).sum())
+            kk = min(k, n_valid)
+            if kk <= 0:
+                out.append([])
+                continue
+            if self.dtype == "float32":
+                top = np.argpartition(-row, kk - 1)[:kk]
+                scores = row[top]
+            else:
+                # Shortlist from the compact scan, then exact float32 re-rank of those rows only
+                n_short = min(n_valid, kk * self.rerank_factor)
+                top = np.sort(np.argpartition(-row, n_short - 1)[:n_short])
+                scores = np.asarray(self.matrix[top], dtype=np.float32) @ q[qi]
+                best = np.argpartition(-scores, kk - 1)[:kk]
+                top, scores = top[best], scores[best]
+            order = np.argsort(-scores)
+            out.append([
+                {
+                    "id": self.ids[i],
+                    "text": self.texts[i],
+                    "metadata": self.metadatas[i],
+                    "distance": float(2.0 - 2.0 * s)
+                }
+                for i, s in zip(top[order], scores[order])
+            ])
+        return out
+
+    def measure_recall(self, k: int = 4, n_queries: int = 50, noise: float = 0.05, seed: int = 0) -> Dict[str, Any]:
+        """
+        recall@k of search() against brute-force float32 search, using perturbed stored vectors
+        as queries. Always 1.0 for float32; stored in self.recall and reported by stats().
+        """
+        n = len(self.ids)
+        if self.dtype == "float32" or n == 0:
+            self.recall = {"k": k, "queries": 0, "recall_at_k": 1.0}
+            return self.recall
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(n, size=min(n_queries, n), replace=False))
+        q = np.asarray(self.matrix[rows], dtype=np.float32)
+        q = self._normalize(q + rng.normal(scale=noise, size=q.shape).astype(np.float32))
+        kk = min(k, n)
+        exact = np.empty((len(q), n), dtype=np.float32)
+        for lo in range(0, n, 16384):
+            exact[:, lo:lo + 16384] = q @ np.asarray(self.matrix[lo:lo + 16384], dtype=np.float32).T
+        truth = np.argpartition(-exact, kk - 1, axis=1)[:, :kk]
+        found = self.search(q, k=kk)
+        hits = sum(len({self.ids[i] for i in t} & {h["id"] for h in f}) for t, f in zip(truth, found))
+        self.recall = {"k": kk, "queries": len(q), "recall_at_k": round(hits / (kk * len(q)), 4)}
+        return self.recall
+
+    def save(self, path_prefix: str):
+        os.makedirs(os.path.dirname(path_prefix) or ".", exist_ok=True)
+        np.save(path_prefix + ".tmp.npy", np.ascontiguousarray(self.matrix, dtype=np.float32))
+        if self.codes is not None:
+            np.save(path_prefix + ".codes.tmp.npy", self.codes)
+        if self.scales is not None:
+            np.save(path_prefix + ".scales.tmp.npy", self.scales)
+        with open(path_prefix + ".tmp.json", "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "texts": self.texts, "metadatas": self.metadatas, "dtype": self.dtype, "recall": self.recall}, f)
+        os.replace(path_prefix + ".tmp.npy", path_prefix + ".npy")
+        if self.codes is not None:
+            os.replace(path_prefix + ".codes.tmp.npy", path_prefix + ".codes.npy")
+        if self.scales is not None:
+            os.replace(path_prefix + ".scales.tmp.npy", path_prefix + ".scales.npy")
+        os.replace(path_prefix + ".tmp.json", path_prefix + ".json")
+
+    @classmethod
+    def load(cls, path_prefix: str, mmap: bool = True, dtype: str = VECTOR_INDEX_DTYPE) -> "MatrixIndex":
+        """The float32 matrix is memory-mapped when mmap=True; the compact copy is always read into RAM."""
+        with open(path_prefix + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(path_prefix + ".npy", mmap_mode="r" if mmap else None)
+        codes = scales = None
+        if dtype != "float32" and meta.get("dtype") == dtype:
+            codes = np.load(path_prefix + ".codes.npy")
+            scales = np.load(path_prefix + ".scales.npy") if dtype == "int8" else None
+        index = cls(meta["ids"], meta["texts"], meta["metadatas"], matrix, dtype=dtype, codes=codes, scales=scales)
+        if meta.get("dtype") == dtype:
+            index.recall = meta.get("recall")
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        exact_bytes = int(self.matrix.nbytes)
+        compact_bytes = int(self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)) if self.codes is not None else 0
+        memory_mapped = isinstance(self.matrix, np.memmap)
+        return {
+            "chunks": len(self.ids),
+            "dim": int(self.matrix.shape[1]) if self.matrix.ndim == 2 and len(self.ids) else 0,
+            "dtype": self.dtype,
+            "bytes": exact_bytes,
+            "compact_bytes": compact_bytes,
+            # What the index keeps in RAM: the float32 matrix unless it is memory-mapped
+            "resident_bytes": compact_bytes + (0 if memory_mapped else exact_bytes),
+            "compression_ratio": round(exact_bytes / compact_bytes, 2) if compact_bytes else 1.0,
+            "memory_mapped": memory_mapped,
+            "rerank_factor": self.rerank_factor if self.dtype != "float32" else None,
+            "recall": self.recall,
+        }
+
+
+def vector_index_path(collection_name: str) -> str:
+    return os.path.join(VECTOR_INDEX_DIR, collection_name)
+
+def vector_index_files(collection_name: str) -> List[str]:
+    """Every file MatrixIndex.save() may write for a collection."""
+    prefix = vector_index_path(collection_name)
+    return [prefix + suffix for suffix in (".npy", ".json", ".codes.npy", ".scales.npy")]
@@ -0,0 +1,195 @@
+import os
+import re
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from .config import WIKI_CACHE_PATH, WIKI_CACHE_TTL, WIKI_NEGATIVE_TTL, WIKI_FETCHER, WIKI_OFFLINE_DIR
+
+
+class WikiFetcher(ABC):
+    """
+    Source of Wikipedia data used by the chat fallback.
+    search() returns candidate page titles (best first); summary() returns the page intro,
+    or None if there is no such page. Transient failures (network, timeouts) should raise.
+    """
+    @abstractmethod
+    def search(self, query: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    def summary(self, title: str, sentences: int = 3) -> Optional[str]:
+        ...
+
+
+class OnlineWikiFetcher(WikiFetcher):
+    """Live lookups through the `wikipedia` package (imported on first lookup)."""
+    @property
+    def _wikipedia(self):
+        import wikipedia
+        return wikipedia
+
+    def search(self, query: str) -> List[str]:
+        return list(self._wikipedia.search(query))
+
+    def summary(self, title: str, sentences: int = 3) -> Optional[str]:
+        try:
+            return self._wikipedia.summary(title, sentences=sentences)
+        except self._wikipedia.exceptions.DisambiguationError as e:
+            # If the term is too vague (e.g., "Python"), pick the first option
+            if not e.options:
+                return None
+            try:
+                return self._wikipedia.summary(e.options[0], sentences=sentences)
+            except self._wikipedia.exceptions.WikipediaException:
+                return None
+        except self._wikipedia.exceptions.PageError:
+            return None
+
+
+class OfflineWikiFetcher(WikiFetcher):
+    """
+    Serves pages from a dict or a directory of <title>.txt files (tests, offline deployments).
+    search() ranks titles by how many query words they share with the title and page text.
+    """
+    def __init__(self, pages: Optional[Dict[str, str]] = None, directory: Optional[str] = None):
+        self.pages: Dict[str, str] = dict(pages or {})
+        if directory and os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".txt"):
+                    with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                        self.pages.setdefault(name[:-4], f.read())
+
+    @staticmethod
+    def _words(text: str) -> set:
+        return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+    def search(self, query: str) -> List[str]:
+        words = self._words(query)
+        scored = []
+        for title, text in self.pages.items():
+            score = 3 * len(words & self._words(title)) + len(words & self._words(text[:2000]))
+            if score:
+                scored.append((-score, title))
+        return [title for _, title in sorted(scored)[:10]]
+
+    def summary(self, title: str, sentences: int = 3) -> Optional[str]:
+        text = self.pages.get(title)
+        if text is None:
+            return None
+        return " ".join(re.split(r"(?<=[.!?])\s+", text.strip())[:sentences])
+
+
+class WikiCache:
+    """
+    Persistent TTL cache (SQLite) in front of a WikiFetcher, for both search results and summaries.
+    "No result" answers are cached too (negative entries, shorter TTL); exceptions are not cached.
+    """
+    def __init__(self, fetcher: WikiFetcher, path: str = WIKI_CACHE_PATH, ttl: float = WIKI_CACHE_TTL, negative_ttl: float = WIKI_NEGATIVE_TTL):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS wiki_cache ("
+            " kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT, fetched_at REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def _lookup(self, kind: str, key: str):
+        """Returns (found, value); value None is a cached negative result."""
+        with self._lock:
+            row = self._db.execute("SELECT value, fetched_at FROM wiki_cache WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            if row is not None:
+                value, fetched_at = row
+                ttl = self.ttl if value is not None else self.negative_ttl
+                if time.time() - fetched_at <= ttl:
+                    if value is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return True, value
+            self.misses += 1
+            return False, None
+
+    def _store(self, kind: str, key: str, value: Optional[str]):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO wiki_cache (kind, key, value, fetched_at) VALUES (?, ?, ?, ?)",
+                (kind, key, value, time.time())
+            )
+            self._db.commit()
+
+    def search(self, query: str) -> List[str]:
+        key = self._normalize(query)
+        found, value = self._lookup("search", key)
+        if found:
+            return value.split("\n") if value else []
+        titles = [t for t in self.fetcher.search(query) if t]
+        self._store("search", key, "\n".join(titles) if titles else None)
+        return titles
+
+    def summary(self, title: str, sentences: int = 3) -> Optional[str]:
+        key = f"{sentences}:{title}"
+        found, value = self._lookup("summary", key)
+        if found:
+            return value
+        text = self.fetcher.summary(title, sentences=sentences)
+        self._store("summary", key, text or None)
+        return text or None
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM wiki_cache WHERE (value IS NOT NULL AND fetched_at < ?) OR (value IS NULL AND fetched_at < ?)",
+                (now - self.ttl, now - self.negative_ttl)
+            )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM wiki_cache").fetchone()[0]
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "fetcher": type(self.fetcher).__name__,
+                "entries": entries,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.hits + self.negative_hits) / lookups) if lookups else 0.0,
+            }
+
+
+def make_wiki_fetcher(kind: str = WIKI_FETCHER) -> WikiFetcher:
+    if kind == "offline":
+        return OfflineWikiFetcher(directory=WIKI_OFFLINE_DIR)
+    if kind == "online":
+        return OnlineWikiFetcher()
+    raise ValueError(f"Unknown WIKI_FETCHER: {kind}")
+
+
+# Built on first lookup, not at import: core_utils is imported by every API and extraction worker
+# (and the tests), and only the processes that actually hit Wikipedia should open the SQLite file
+_wiki_cache: Optional[WikiCache] = None
+_wiki_cache_lock = threading.Lock()
+
+def get_wiki_cache() -> WikiCache:
+    global _wiki_cache
+    with _wiki_cache_lock:
+        if _wiki_cache is None:
+            _wiki_cache = WikiCache(make_wiki_fetcher())
+            _wiki_cache.purge_expired()
+        return _wiki_cache
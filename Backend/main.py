@@ -1,15 +1,43 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 import shutil
 import os
-from typing import List
+import json
+import tempfile
+import threading
+from typing import List, Optional
 from pydantic import BaseModel
 
 # Import the service we just built
-from app.rag_engine import rag_service
+from app.rag_engine import rag_service, DEFAULT_NAMESPACE
+from app.core_utils import get_model_cache_stats, shutdown_extract_pool
+from app.chat_engine import build_where_filter
+from app.rate_limiter import provider_rate_limiter
+from app.jobs import job_manager
+from app.wiki_cache import get_wiki_cache
+from app.llm_async import close_async_llm_client
+from app.token_budget import token_estimator
+from app.config import STARTUP_WARMUP, EMBEDDING_SERVER, CHROMA_HOST
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if EMBEDDING_SERVER and not CHROMA_HOST:
+        # A shared embedding server implies several API workers, each of which would open its own
+        # PersistentClient on the same directory; Chroma does not support concurrent writers there
+        print("Warning: EMBEDDING_SERVER is set without CHROMA_HOST; every API worker opens its own "
+              "PersistentClient on the local store. Run a Chroma server and set CHROMA_HOST for multi-worker deployments.")
+    # Nothing heavy happens at import time; optionally load the model/store in the background
+    if STARTUP_WARMUP:
+        threading.Thread(target=rag_service.warm_up, name="warm-up", daemon=True).start()
+    yield
+    # Releases the pooled keep-alive connections of the async LLM client
+    await close_async_llm_client()
+    shutdown_extract_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # 1. CORS Setup (Allows your React frontend to talk to this Python backend)
 app.add_middleware(
@@ -23,76 +51,153 @@ app.add_middleware(
 # 2. Define Request Models
 class ChatRequest(BaseModel):
     query: str
+    # Optional retrieval scope, e.g. only ["lecture3.pdf"] or pages 10-20
+    source_files: Optional[List[str]] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+
+def _chat_scope(payload: ChatRequest):
+    return build_where_filter(payload.source_files, payload.page_from, payload.page_to)
 
 # 3. API Endpoints
+# Corpus endpoints take ?session_id=... ; each session has its own collection (default: "default")
 
 @app.get("/")
 def read_root():
     return {"message": "RAG Backend is Running!"}
 
+@app.get("/health")
+def health():
+    """
+    Liveness: the process is up and serving (does not load anything)
+    """
+    return {"status": "ok", **rag_service.status()}
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness: embedder and vector store are loaded and the LLM key is configured
+    """
+    status = rag_service.status()
+    if not rag_service.is_ready():
+        return JSONResponse(status_code=503, content={"status": "loading", **status})
+    return {"status": "ready", **status}
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Runtime cache / performance counters
+    """
+    return {
+        "model_cache": get_model_cache_stats(),
+        "rate_limiter": provider_rate_limiter.stats(),
+        "namespaces": rag_service.namespace_stats(),
+        "embedding_cache": rag_service.embedding_stats(),
+        "query_batching": rag_service.query_batching_stats(),
+        "wiki_cache": get_wiki_cache().stats(),
+        "token_estimator": token_estimator.stats(),
+    }
+
 
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(files: List[UploadFile] = File(...), mode: str = "incremental", session_id: str = DEFAULT_NAMESPACE):
     """
-    Uploads multiple files (Max 5), merges them, and processes chunks.
+    Uploads multiple files (Max 5) and ingests them in the background into the session's corpus.
+    Returns a job_id right away; poll /jobs/{job_id} for progress.
+    mode=incremental (default) only embeds new content; mode=replace rebuilds the corpus.
     """
     # 1. Validation: Max 5 files
     if len(files) > 5:
         return {"status": "error", "message": "Maximum 5 files allowed."}
+    if mode not in ("incremental", "replace"):
+        return {"status": "error", "message": f"Unknown mode: {mode}"}
 
+    # Each upload gets its own temp dir so concurrent uploads can't clobber each other's files
+    upload_dir = tempfile.mkdtemp(prefix="upload_")
     saved_file_paths = []
     
     try:
         # 2. Save all files temporarily
         for file in files:
-            file_location = f"temp_{file.filename}"
+            file_location = os.path.join(upload_dir, f"temp_{os.path.basename(file.filename)}")
             with open(file_location, "wb+") as file_object:
                 shutil.copyfileobj(file.file, file_object)
             saved_file_paths.append(file_location)
-        
-        # 3. Process all files together
-        status_message = rag_service.process_files(saved_file_paths)
-        
-        return {"status": "success", "message": status_message}
-        
     except Exception as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
         return {"status": "error", "message": str(e)}
-        
-    finally:
-        # 4. Cleanup: Delete temp files
-        for path in saved_file_paths:
-            if os.path.exists(path):
-                os.remove(path)
+
+    # 3. Process all files together on the background worker; temp files are removed when it finishes
+    job_id = job_manager.submit(
+        lambda progress: rag_service.process_files(saved_file_paths, mode=mode, progress_fn=progress, session_id=session_id),
+        on_finish=lambda: shutil.rmtree(upload_dir, ignore_errors=True)
+    )
+    return {"status": "accepted", "job_id": job_id, "message": f"Processing {len(saved_file_paths)} file(s)..."}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Status of a background ingestion job: status, stage and its done/total, running counts and errors.
+    Stages: copy (unchanged documents) -> extract (files) -> chunk (documents; counts.chunks) ->
+    embed (new chunk texts) -> upsert (chunks; counts.embedded / counts.reused) -> index.
+    New documents are streamed, so extract/chunk/embed/upsert interleave and embed/upsert totals
+    grow until the last document is chunked.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.get("/summarize")
-def get_summary():
+async def get_summary(session_id: str = DEFAULT_NAMESPACE):
     """
-    Trigger map-reduce summarization
+    Trigger map-reduce summarization (map calls are gathered on the event loop)
     """
     try:
-        summary_text = rag_service.generate_summary()
+        summary_text = await rag_service.agenerate_summary(session_id=session_id)
         return {"summary": summary_text}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat")
-def chat_bot(payload: ChatRequest):
+async def chat_bot(payload: ChatRequest, session_id: str = DEFAULT_NAMESPACE):
     """
     Chat with the PDF
     """
     try:
-        response_text = rag_service.chat(payload.query)
-        return {"response": response_text}
+        result = await rag_service.achat(payload.query, session_id=session_id, where=_chat_scope(payload))
+        return {"response": result["answer"], "from_cache": result["from_cache"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+def chat_bot_stream(payload: ChatRequest, session_id: str = DEFAULT_NAMESPACE):
+    """
+    Chat with the PDF, streamed as Server-Sent Events:
+    'sources' first, then 'token' events as the answer arrives, then 'done'.
+    A 'reset' event means: drop the tokens shown so far (the model gave up mid-answer and
+    the Wikipedia fallback follows).
+    """
+    def event_source():
+        try:
+            for item in rag_service.chat_stream(payload.query, session_id=session_id, where=_chat_scope(payload)):
+                yield f"event: {item['event']}\ndata: {json.dumps(item['data'])}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/quiz")
-def get_quiz():
+async def get_quiz(session_id: str = DEFAULT_NAMESPACE):
     """
     Generate a quiz
     """
     try:
-        quiz_data = rag_service.generate_quiz()
+        quiz_data = await rag_service.agenerate_quiz(session_id=session_id)
         return {"quiz": quiz_data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,46 @@
+import random
+
+from app.core_utils import build_combined_document, iter_chunk_pages, simple_chunk_text
+
+WORDS = ["lecture", "entropy", "O(n)", "cs-101", "graph", "the", "a", "theorem", "proof", "h2o", "tf.idf", "x"]
+
+
+def _random_text(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(0, 400)):
+        parts.append(rng.choice(WORDS))
+        # Separators that preprocess_for_llm rewrites: hyphenated line breaks, single/double newlines, runs of spaces
+        parts.append(rng.choice([" ", " ", " ", "\n", "\n\n", "-\n", "   "]))
+    return "".join(parts)
+
+
+def _random_pages(rng: random.Random):
+    pages = []
+    for number in range(1, rng.randint(1, 8) + 1):
+        text = "" if rng.random() < 0.15 else _random_text(rng)
+        pages.append({"page_number": number, "pdf_text": text if rng.random() > 0.05 else None})
+    return pages
+
+
+def _texts_and_offsets(chunks):
+    # Only what chunking itself decides; metadata added on top (pages, sources, ...) is ignored
+    return [(c["text"], c["start_char"], c["end_char"]) for c in chunks]
+
+
+def test_streaming_chunker_matches_combined_document():
+    rng = random.Random(1234)
+    for _ in range(2000):
+        pages = _random_pages(rng)
+        chunk_size = rng.randint(20, 1200)
+        overlap = rng.randint(0, chunk_size - 1)
+        expected = simple_chunk_text(build_combined_document(pages)["combined_text"], chunk_size=chunk_size, overlap=overlap)
+        streamed = list(iter_chunk_pages(pages, chunk_size=chunk_size, overlap=overlap))
+        assert _texts_and_offsets(streamed) == _texts_and_offsets(expected), (chunk_size, overlap, pages)
+
+
+def test_streaming_chunker_default_sizes():
+    rng = random.Random(99)
+    for _ in range(200):
+        pages = _random_pages(rng)
+        expected = simple_chunk_text(build_combined_document(pages)["combined_text"])
+        assert _texts_and_offsets(iter_chunk_pages(pages)) == _texts_and_offsets(expected)
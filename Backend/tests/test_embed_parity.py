@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from app.config import EMBED_PARITY_MIN_OVERLAP
+from app.embed_bench import benchmark_backend, topk_overlap
+
+CORPUS = [
+    "Entropy measures the uncertainty of a random variable; a fair coin has one bit of entropy.",
+    "Dijkstra's algorithm finds shortest paths in graphs with non-negative edge weights.",
+    "A binary search tree keeps keys ordered so lookups take O(log n) on a balanced tree.",
+    "Photosynthesis converts light energy, water and carbon dioxide into glucose and oxygen.",
+    "Mitochondria produce most of the cell's ATP through oxidative phosphorylation.",
+    "The French Revolution began in 1789 with the storming of the Bastille.",
+    "Supply and demand curves intersect at the market equilibrium price.",
+    "Newton's second law states that force equals mass times acceleration.",
+    "TF-IDF weights a term by its frequency in a document and its rarity across the corpus.",
+    "Gradient descent updates parameters in the direction that reduces the loss.",
+    "The mitochondrial genome is inherited from the mother in most animals.",
+    "Inflation is a sustained increase in the general price level of goods and services.",
+    "A hash table maps keys to buckets and gives average constant-time lookups.",
+    "Water boils at 100 degrees Celsius at sea-level atmospheric pressure.",
+    "The Treaty of Versailles ended the First World War in 1919.",
+    "Ohm's law relates voltage, current and resistance: V = I * R.",
+]
+QUERIES = [
+    "What does entropy measure?",
+    "How do you find the shortest path in a weighted graph?",
+    "Where is most ATP made in a cell?",
+    "When did the French Revolution start?",
+    "What is the equilibrium price?",
+    "How are terms weighted in TF-IDF?",
+    "What is inflation?",
+    "What is Ohm's law?",
+]
+K = 3
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    return benchmark_backend("torch", CORPUS, QUERIES, batch_size=8)
+
+
+@pytest.mark.parametrize("backend", ["int8", "onnx"])
+def test_backend_topk_matches_torch(baseline, backend):
+    if backend == "onnx":
+        pytest.importorskip("optimum")
+        pytest.importorskip("onnxruntime")
+    candidate = benchmark_backend(backend, CORPUS, QUERIES, batch_size=8)
+    assert topk_overlap(baseline, candidate, K)["mean"] >= EMBED_PARITY_MIN_OVERLAP
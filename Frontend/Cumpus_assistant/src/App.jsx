@@ -19,6 +19,14 @@ import LibraryTab from './components/LibraryTab';
 
 const API_BASE = "http://127.0.0.1:8000";
 
+// Each browser gets its own corpus on the backend (uploads never touch other students' documents)
+const SESSION_ID = localStorage.getItem('session_id') || (() => {
+  const id = crypto.randomUUID();
+  localStorage.setItem('session_id', id);
+  return id;
+})();
+const SESSION_QS = `session_id=${encodeURIComponent(SESSION_ID)}`;
+
 function App() {
   // --- UI States ---
   const [activeTab, setActiveTab] = useState('upload');
@@ -51,8 +59,21 @@ function App() {
     setStatusMsg(`Uploading and merging ${files.length} file(s)...`);
     
     try {
-      const res = await axios.post(`${API_BASE}/upload`, formData);
-      setStatusMsg(res.data.message);
+      const res = await axios.post(`${API_BASE}/upload?${SESSION_QS}`, formData);
+      if (res.data.status !== 'accepted') throw new Error(res.data.message);
+
+      // Ingestion runs in the background: poll the job until it finishes
+      let job;
+      while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        job = (await axios.get(`${API_BASE}/jobs/${res.data.job_id}`)).data;
+        if (job.status === 'done' || job.status === 'error') break;
+        const progress = job.total ? ` (${job.done}/${job.total})` : "";
+        setStatusMsg(`Processing: ${job.stage || job.status}${progress}...`);
+      }
+      if (job.status === 'error') throw new Error(job.error);
+
+      setStatusMsg(job.message);
       alert("Success! Documents merged into knowledge base.");
       setActiveTab('summary'); // Auto-switch to summary
     } catch (error) {
@@ -65,7 +86,7 @@ function App() {
   const fetchSummary = async () => {
     setLoading(true);
     try {
-      const res = await axios.get(`${API_BASE}/summarize`);
+      const res = await axios.get(`${API_BASE}/summarize?${SESSION_QS}`);
       setSummary(res.data.summary);
     } catch (error) {
       alert("Failed to fetch summary.");
@@ -83,10 +104,48 @@ function App() {
     // Optimistic UI update
     setChatHistory([...newHistory, { role: 'bot', content: "..." }]);
 
+    // Stream the answer over SSE: 'sources' first, then 'token' events as they arrive
     try {
-      const res = await axios.post(`${API_BASE}/chat`, { query: question });
-      setChatHistory([...newHistory, { role: 'bot', content: res.data.response }]);
+      const res = await fetch(`${API_BASE}/chat/stream?${SESSION_QS}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ query: question }),
+      });
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let answer = "";
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const raw of events) {
+          const eventLine = raw.split("\n").find((l) => l.startsWith("event: "));
+          const dataLine = raw.split("\n").find((l) => l.startsWith("data: "));
+          if (!eventLine || !dataLine) continue;
+          const event = eventLine.slice(7);
+          const data = JSON.parse(dataLine.slice(6));
+
+          if (event === 'token') {
+            answer += data;
+            setChatHistory([...newHistory, { role: 'bot', content: answer }]);
+          } else if (event === 'reset') {
+            // The model gave up mid-answer; the Wikipedia fallback replaces what was shown
+            answer = "";
+            setChatHistory([...newHistory, { role: 'bot', content: "..." }]);
+          } else if (event === 'error') {
+            throw new Error(data);
+          }
+        }
+      }
     } catch (error) {
+      console.error(error);
       setChatHistory([...newHistory, { role: 'bot', content: "Error connecting to AI." }]);
     }
   };
@@ -94,7 +153,7 @@ function App() {
   const fetchQuiz = async () => {
     setLoading(true);
     try {
-      const res = await axios.get(`${API_BASE}/quiz`);
+      const res = await axios.get(`${API_BASE}/quiz?${SESSION_QS}`);
       setQuiz(res.data.quiz);
     } catch (error) {
       alert("Failed to generate quiz.");